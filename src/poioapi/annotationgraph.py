@@ -13,9 +13,10 @@ import sys
 import os.path
 import re
 import codecs
+import collections
+import bisect
 
-from xml.dom import minidom
-from xml.etree.ElementTree import Element, SubElement, tostring
+from xml.etree.ElementTree import Element, SubElement
 
 import poioapi.io.elan
 import poioapi.io.mandinka
@@ -26,14 +27,17 @@ import poioapi.io.toolboxxml
 import poioapi.io.shoebox
 import poioapi.io.typecraft
 import poioapi.io.odin
+import poioapi.io.xmlwriter
 
 import poioapi.data
 import poioapi.mapper
+import poioapi.query
 
 import graf
 
 from poioapi.tree import Tree
 
+
 class AnnotationGraph():
     """This class stores annotation data as annotation graphs and makes it
     accessible in tier hierarchies. It reads data from various file formats.
@@ -52,6 +56,7 @@ class AnnotationGraph():
                         data_structure_type)))
 
         self.graf = None
+        self.graf_loader = None
         self.tier_hierarchies = None
         self.meta_information = None
         self.root_tiers = []
@@ -63,13 +68,62 @@ class AnnotationGraph():
 
         self.tier_mapper = poioapi.mapper.TierMapper()
 
+        self._indexed_graf = None
+        self._index_generation = 0
+        self._tier_nodes = None
+        self._tier_roots = None
+        self._tier_children = None
+        self._root_orders = dict()
+        self._interval_indexes = dict()
+
+        self.search_index = None
+        self._tier_value_table = None
+
     @classmethod
-    def from_elan(cls, stream):
+    def from_elan(cls, stream, streaming=False, tiers=None):
         """This method generates a GrAF object
         from a Elan file.
 
+        Parameters
+        ----------
+        stream : str or io.stream
+            The path to an Elan file.
+        streaming : bool, optional
+            Read the file with the streaming parser, that does not keep the
+            annotation elements of the file in memory.
+        tiers : list of str, optional
+            Only load the tiers with the given IDs and their parent tiers.
+
         """
-        return cls._from_file(stream, poioapi.data.EAF)
+        return cls._from_file(stream, poioapi.data.EAF, streaming=streaming,
+                              tiers=tiers)
+
+    @classmethod
+    def from_elan_files(cls, streams, streaming=False, tiers=None):
+        """This method generates GrAF objects from several Elan files.
+        Files that were created from the same Elan template share the
+        parsed tier structure and the tier hierarchies, so for those only
+        the time slots and annotations are read again.
+
+        Parameters
+        ----------
+        streams : iterable of str or io.stream
+            The paths to the Elan files.
+        streaming : bool, optional
+            Read the files with the streaming parser.
+        tiers : list of str, optional
+            Only load the tiers with the given IDs and their parent tiers.
+
+        Returns
+        -------
+        annotation_graphs : generator
+            The annotation graph of each file, in the order of the files.
+
+        """
+        templates = dict()
+        for stream in streams:
+            yield cls._from_file(stream, poioapi.data.EAF,
+                streaming=streaming, tiers=tiers, templates=templates)
 
     @classmethod
     def from_mandinka(cls, stream, tier_map_file_path=''):
@@ -122,22 +176,35 @@ class AnnotationGraph():
         return cls._from_file(stream, poioapi.data.TOOLBOX, tier_map_file_path=tier_map_file_path)
 
     @classmethod
-    def from_graf(cls, stream):
+    def from_graf(cls, stream, lazy=False):
         """Load the project annotation graph from a GrAF/XML file or stream.
 
         Parameters
         ----------
         stream : str or io.stream
             The path to a GrAF/XML file.
+        lazy : bool, optional
+            If True and the file is a GrAF header, the annotation files are
+            not loaded at once. The file of a tier and the files it depends
+            on are loaded when the nodes of the tier are requested for the
+            first time, see `poioapi.io.graf.LazyGraphLoader`.
 
         """
         ag = cls()
+        if lazy and os.path.splitext(getattr(stream, 'name', stream))[1] \
+                == '.hdr':
+            ag.graf_loader = poioapi.io.graf.LazyGraphLoader(stream)
+            ag.graf = ag.graf_loader.graph
+            ag.from_file_type = poioapi.data.GRAF
+            return ag
+
         if not hasattr(stream, 'read'):
             stream = ag._open_file_(stream)
 
         parser = graf.GraphParser()
         ag.graf = parser.parse(stream)
         ag.from_file_type = poioapi.data.GRAF
+        ag.build_indexes()
 
         return ag
 
@@ -172,7 +239,9 @@ class AnnotationGraph():
 
         parser = None
         if stream_type == poioapi.data.EAF:
-            parser = poioapi.io.elan.Parser(stream)
+            parser = poioapi.io.elan.Parser(
+                stream, streaming=kwargs.get("streaming", False),
+                tiers=kwargs.get("tiers"), templates=kwargs.get("templates"))
         elif stream_type == poioapi.data.MANDINKA:
             if not hasattr(stream, 'read'):
                 stream = codecs.open(stream, "rb")
@@ -204,6 +273,7 @@ class AnnotationGraph():
         ag.primary_data = converter.primary_data
 
         ag.source_type = stream_type
+        ag.build_indexes(converter.children_for_tier)
 
         # set the first tier hierarchy as the default data_structure_type
         ag.structure_type_handler = \
@@ -214,11 +284,95 @@ class AnnotationGraph():
 
     ########################################################## Methods
 
-    def root_nodes(self):
+    def build_indexes(self, children_for_tier=None):
+        """Build the lookup indexes for the nodes of the graph. The tier
+        index maps each tier name to the nodes of that tier, in the order of
+        the nodes in the graph. The children index maps a parent node ID to
+        a dict from tier names to the child nodes of that tier, in the order
+        of the edges. The indexes are rebuilt automatically when the graph is
+        replaced, but not when the graph itself is changed: this method must
+        be called after nodes, edges or roots were added to or removed from
+        the graph, or after the ID of a node was changed in place. The
+        cached root order, the interval indexes, the tier value table and
+        the search index are rebuilt after this method was called.
+
+        Parameters
+        ----------
+        children_for_tier : dict, optional
+            A children index that was already built while converting the
+            graph, as in `poioapi.io.graf.GrAFConverter.children_for_tier`.
+
+        """
+        self._tier_nodes = collections.defaultdict(list)
+        self._tier_roots = collections.defaultdict(list)
+
+        if children_for_tier is None:
+            children_for_tier = {}
+            if self.graf is not None:
+                for node in self.graf.nodes:
+                    children = collections.defaultdict(list)
+                    for child in node.iter_children():
+                        for prefix in poioapi.io.graf.tier_prefixes(child.id):
+                            children[prefix].append(child)
+                    if len(children) > 0:
+                        children_for_tier[node.id] = children
+        self._tier_children = children_for_tier
+
+        if self.graf is not None:
+            for node in self.graf.nodes:
+                for prefix in poioapi.io.graf.tier_prefixes(node.id):
+                    self._tier_nodes[prefix].append(node)
+
+            for node_id in self.graf.header.roots:
+                node = self.graf.nodes[node_id]
+                for prefix in poioapi.io.graf.tier_prefixes(node_id):
+                    self._tier_roots[prefix].append(node)
+
+        self._indexed_graf = self.graf
+        self._index_generation += 1
+
+    def _check_indexes(self):
+        """Build the indexes if the graph was replaced since they were built.
+
+        """
+        if self._indexed_graf is not self.graf or self._tier_nodes is None:
+            self.build_indexes()
+
+    def _load_tiers(self, tier_names):
+        """Load the GrAF files of the given tiers if the graph is loaded
+        lazily. The indexes are built again once if any file was loaded, so
+        caches that are built after this call are not stale.
+
+        Parameters
+        ----------
+        tier_names : list of str
+            The names of the tiers to load.
+
+        """
+        if self.graf_loader is None:
+            return
+
+        loaded = False
+        for tier_name in tier_names:
+            if self.graf_loader.load_tier(tier_name):
+                loaded = True
+        if loaded:
+            self.build_indexes()
+
+    def root_nodes(self, offset=0, limit=None):
         """Retrieve the root nodes from the annotation graph. Root nodes are
         the nodes that have a label that is the root node of the data structure
         type as the root node. The root nodes are order by the "start" value
-        of their region.
+        of their region. The sorted order is cached, so a window of the root
+        nodes only costs the size of the window.
+
+        Parameters
+        ----------
+        offset : int, optional
+            The index of the first root node to return.
+        limit : int, optional
+            The maximum number of root nodes to return. All root nodes
+            starting at `offset` are returned if this is None.
 
         Returns
         -------
@@ -227,14 +381,68 @@ class AnnotationGraph():
 
         """
 
-        res = list()
+        sorted_roots = self._sorted_root_nodes()
+        if limit is None:
+            return sorted_roots[offset:]
+        return sorted_roots[offset:offset + limit]
+
+    def root_node_ids(self):
+        """Return the IDs of the root nodes in sorted order. The position of
+        an ID in the list is the ordinal of the root node, indexes over the
+        root nodes can use the ordinals as keys. The list must not be
+        modified.
+
+        Returns
+        -------
+        root_ids : list of str
+
+        """
+
+        return self._root_order()[1]
+
+    def root_ordinals(self):
+        """Return a dict from the IDs of the root nodes to their ordinal,
+        i.e. their position in `root_node_ids`. The dict must not be
+        modified.
+
+        Returns
+        -------
+        ordinals : dict
+
+        """
+
+        return self._root_order()[2]
+
+    def _sorted_root_nodes(self):
+        return self._root_order()[0]
+
+    def _root_order(self):
+        """Return the sorted root nodes, their IDs and a dict from the IDs to
+        the ordinals. The order is cached for the root tier of each data
+        structure type that was used, and sorted again when the indexes
+        were built again.
+
+        """
+
         base_tier_name = self.structure_type_handler.flat_data_hierarchy[0]
-        res = self.nodes_for_tier(base_tier_name)
+        self._load_tiers([base_tier_name])
+        self._check_indexes()
+        key = self._index_generation
 
-        try:
-            return sorted(res, key=lambda node: node.links[0][0].start)
-        except IndexError as indexError:
-            return res
+        cached = self._root_orders.get(base_tier_name)
+        if cached is None or cached[0] != key:
+            res = self.nodes_for_tier(base_tier_name)
+            try:
+                res = sorted(res, key=lambda node: node.links[0][0].start)
+            except IndexError as indexError:
+                pass
+
+            root_ids = [node.id for node in res]
+            ordinals = dict((node_id, i) for i, node_id in enumerate(root_ids))
+            cached = (key, (res, root_ids, ordinals))
+            self._root_orders[base_tier_name] = cached
+
+        return cached[1]
 
     def nodes_for_tier(self, tier_name, parent_node = None):
         """Retreive all nodes for a given tier name. The parameter
@@ -256,24 +464,93 @@ class AnnotationGraph():
         nodes : list of graf.Node
 
         """
-        #node = self.graf.nodes[node_id]
         res = []
+        self._load_tiers([tier_name])
+        self._check_indexes()
         if parent_node:
-            for target_node in parent_node.iter_children():
-                if target_node.id.startswith(tier_name + poioapi.io.graf.GRAFSEPARATOR):
-                    res.append(target_node)
+            children = self._tier_children.get(parent_node.id)
+            if children is not None and tier_name in children:
+                res = list(children[tier_name])
         else:
-            if tier_name in self.root_tiers:
-                for target_node_id in self.graf.header.roots:
-                    n = self.graf.nodes[target_node_id]
-                    if n.id.startswith(tier_name + poioapi.io.graf.GRAFSEPARATOR):
-                        res.append(self.graf.nodes[target_node_id])
-            if len(res) == 0:
-                for target_node in self.graf.nodes:
-                    if target_node.id.startswith(tier_name + poioapi.io.graf.GRAFSEPARATOR):
-                        res.append(target_node)
+            if tier_name in self.root_tiers and tier_name in self._tier_roots:
+                res = list(self._tier_roots[tier_name])
+            elif tier_name in self._tier_nodes:
+                res = list(self._tier_nodes[tier_name])
         return res
 
+    def nodes_in_range(self, tier_name, start, end, contained=False):
+        """Return the nodes of a tier whose regions overlap a time range.
+        Regions are treated as half-open ranges [start, end), a range with
+        start equal to end searches for the nodes at that point in time.
+        The lookup uses an interval index per tier, which is built on the
+        first call and built again after `build_indexes`.
+
+        Parameters
+        ----------
+        tier_name : str
+            The name of the tier to search.
+        start : int
+            The start of the range, in the unit of the region anchors
+            (milliseconds for Elan files).
+        end : int
+            The end of the range.
+        contained : bool, optional
+            If True only return nodes whose region lies completely in the
+            range.
+
+        Returns
+        -------
+        nodes : list of graf.Node
+            The nodes, ordered by the start and end of their regions.
+
+        """
+
+        interval_index = self._interval_index(tier_name)
+        if contained:
+            return interval_index.contained(start, end)
+        return interval_index.overlapping(start, end)
+
+    def overlapping(self, node, tier_name=None):
+        """Return the nodes whose regions overlap the region of a node.
+
+        Parameters
+        ----------
+        node : graf.Node
+            The node to find the overlapping nodes for.
+        tier_name : str, optional
+            The tier to search. The tier of the node if None.
+
+        Returns
+        -------
+        nodes : list of graf.Node
+            The overlapping nodes without the node itself, ordered by the
+            start and end of their regions.
+
+        """
+
+        if not node.links:
+            return []
+
+        if tier_name is None:
+            tier_name = node.id.rpartition(poioapi.io.graf.GRAFSEPARATOR)[0]
+
+        region = node.links[0][0]
+        return [n for n in self.nodes_in_range(tier_name, region.start,
+                                               region.end)
+                if n is not node]
+
+    def _interval_index(self, tier_name):
+        self._load_tiers([tier_name])
+        self._check_indexes()
+        key = self._index_generation
+
+        cached = self._interval_indexes.get(tier_name)
+        if cached is None or cached[0] != key:
+            cached = (key, IntervalIndex(self.nodes_for_tier(tier_name)))
+            self._interval_indexes[tier_name] = cached
+
+        return cached[1]
+
     def annotations_for_tier(self, tier_name, node=None):
         """Return all annotations of the given node that belong to the given
         tier name. The tier name is matched with the `label` of the
@@ -344,7 +621,8 @@ class AnnotationGraph():
         return self.annotation_value_for_annotation(
             node.annotations.get_first())
 
-    def as_html_table(self, filtered = False, full_html = True):
+    def as_html_table(self, filtered = False, full_html = True, start = 0,
+            count = None):
         """Return the graph as a HTML table.
 
         Parameters
@@ -354,35 +632,94 @@ class AnnotationGraph():
         full_html: bool
             Whether to return a complete HTML page (i.e. with "<html>" etc.)
             or just the <table> element.
+        start : int, optional
+            The index of the first root node to render. If `filtered` is
+            True this is the index in the filtered root nodes.
+        count : int, optional
+            The maximum number of root nodes to render, all if None.
 
         Returns
         -------
         html = str
             The HTML for the GrAF graph.
 
+        See also
+        --------
+        iter_html_table, write_html_table
+
         """
-        html = ""
-        if full_html:
-            html = "<html><head><meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\" /></head><body>\n"
+        return "".join(
+            self.iter_html_table(filtered, full_html, start, count))
 
-        for i, root_node in enumerate(self.root_nodes()):
-            if filtered and (len(self.filtered_node_ids) == 0 or \
-                    root_node.id not in self.filtered_node_ids[-1]):
-                continue
+    def iter_html_table(self, filtered = False, full_html = True, start = 0,
+            count = None):
+        """Generate the HTML table of the graph in fragments. There is one
+        fragment for each root node, plus the head and the end of the page
+        if `full_html` is True. Only the fragment of the current root node is
+        kept in memory.
+
+        Parameters
+        ----------
+        filtered : bool
+            Whether to us the filtered graph or the full graph.
+        full_html: bool
+            Whether to generate a complete HTML page (i.e. with "<html>" etc.)
+            or just the <table> elements.
+        start : int, optional
+            The index of the first root node to render. If `filtered` is
+            True this is the index in the filtered root nodes.
+        count : int, optional
+            The maximum number of root nodes to render, all if None.
+
+        Returns
+        -------
+        fragments : generator of str
+            The HTML fragments for the GrAF graph.
 
-            html += "<table style=\"border-collapse:collapse;border:1px solid black;margin-bottom:20px;\">"
-            html += "<tr><td style=\"padding:4px;border:1px solid black;\">{0}</td>".format(i)
-            html += "<td style=\"border:1px solid black;\">"
+        """
+        if full_html:
+            yield "<html><head><meta http-equiv=\"Content-Type\" content=\"text/html; charset=utf-8\" /></head><body>\n"
+
+        for i, root_node in self._root_nodes_window(filtered, start, count):
+            parts = [
+                "<table style=\"border-collapse:collapse;border:1px solid black;margin-bottom:20px;\">",
+                "<tr><td style=\"padding:4px;border:1px solid black;\">{0}</td>".format(i),
+                "<td style=\"border:1px solid black;\">"]
 
-            html += self._node_as_html_table(
-                root_node, self.structure_type_handler.data_hierarchy)
+            self._append_node_html(root_node,
+                self.structure_type_handler.data_hierarchy, parts)
 
-            html += "</td></tr></table>"
+            parts.append("</td></tr></table>")
+            yield "".join(parts)
 
         if full_html:
-            html += "</body></html>"
+            yield "</body></html>"
+
+    def write_html_table(self, stream, filtered = False, full_html = True,
+            start = 0, count = None):
+        """Write the graph as a HTML table to a stream. The table is written
+        one root node at a time.
+
+        Parameters
+        ----------
+        stream : io stream
+            A text stream to write the HTML to, for example a file that was
+            opened with `codecs.open(filename, "w", "utf-8")`.
+        filtered : bool
+            Whether to us the filtered graph or the full graph.
+        full_html: bool
+            Whether to write a complete HTML page (i.e. with "<html>" etc.)
+            or just the <table> elements.
+        start : int, optional
+            The index of the first root node to render. If `filtered` is
+            True this is the index in the filtered root nodes.
+        count : int, optional
+            The maximum number of root nodes to render, all if None.
 
-        return html
+        """
+        for fragment in self.iter_html_table(filtered, full_html, start,
+                count):
+            stream.write(fragment)
 
     def _node_as_html_table(self, node, hierarchy):
         """Create an html table for a node.
@@ -401,24 +738,37 @@ class AnnotationGraph():
 
         """
 
-        table = "<table style=\"margin:0;padding:0;float:left;border-collapse:collapse;\">"
+        parts = []
+        self._append_node_html(node, hierarchy, parts)
+        return "".join(parts)
 
-        inserted = 0
+    def _append_node_html(self, node, hierarchy, parts):
+        """Append the parts of the html table for a node to a list.
 
-        for i, t in enumerate(hierarchy):
+        Parameters
+        ----------
+        node : array_like
+            The root node to start the traversal.
+        hierarchy: array_like
+            An array with the data structure hierarchy.
+        parts : list of str
+            The list to append the html to.
+
+        """
 
-            table += "<tr style=\"margin:0;padding:0;\">"
+        parts.append("<table style=\"margin:0;padding:0;float:left;border-collapse:collapse;\">")
+
+        for t in hierarchy:
+
+            parts.append("<tr style=\"margin:0;padding:0;\">")
 
             if type(t) is list:
-                table += "<td style=\"margin:0;padding:0px;\">"
-                node_list = self.nodes_for_tier(t[0], node)
-                for i, n in enumerate(node_list):
-                    table += self._node_as_html_table(n, t)
+                parts.append("<td style=\"margin:0;padding:0px;\">")
+                for n in self.nodes_for_tier(t[0], node):
+                    self._append_node_html(n, t, parts)
 
-                table += "</td>"
+                parts.append("</td>")
             else:
-                #row = self.structure_type_handler.flat_data_hierarchy.index(t)
-
                 a_list = self.annotations_for_tier(t, node)
                 a = ""
                 if len(a_list) > 0:
@@ -426,25 +776,63 @@ class AnnotationGraph():
                 if a == "":
                     a = "&nbsp;"
 
-                #if column in table[row]:
-                #    table[row][column] = (a, table[row][column][1])
-                #else:
-                #    table[row][column] = (a, 1)
-                table += "<td style=\"margin:0;padding:3px;\">{0}</td>".format(a)
+                parts.append("<td style=\"margin:0;padding:3px;\">{0}</td>".format(a))
+
+            parts.append("</tr>")
+
+        parts.append("</table>")
+
+    def _root_nodes_window(self, filtered, start, count):
+        """Return a window of the root nodes together with their index in
+        all root nodes. If `filtered` is True the window is taken from the
+        root nodes of the last filter.
+
+        Returns
+        -------
+        root_nodes : list of tuple
+            Pairs of the index and the root node.
+
+        """
+
+        if not filtered:
+            return list(enumerate(self.root_nodes(start, count), start))
+
+        if len(self.filtered_node_ids) == 0:
+            return []
+
+        node_ids = self.filtered_node_ids[-1]
+        if count is None:
+            node_ids = node_ids[start:]
+        else:
+            node_ids = node_ids[start:start + count]
+
+        sorted_roots, _, ordinals = self._root_order()
+        return [(ordinals[node_id], sorted_roots[ordinals[node_id]])
+                for node_id in node_ids]
+
+    def as_tree(self, filtered=False, start=0, count=None):
+        """Return the graph as a tree of `poioapi.tree.Tree` objects.
 
-            table += "</tr>"
+        Parameters
+        ----------
+        filtered : bool
+            Whether to us the filtered graph or the full graph.
+        start : int, optional
+            The index of the first root node in the tree. If `filtered` is
+            True this is the index in the filtered root nodes.
+        count : int, optional
+            The maximum number of root nodes in the tree, all if None.
 
-        table += "</table>"
-        return table
+        Returns
+        -------
+        tree : poioapi.tree.Tree
+            The tree with a child for each root node.
 
-    def as_tree(self, filtered=False):
+        """
 
         tree = Tree("root")
 
-        for node in enumerate(self.root_nodes()):
-            if filtered and (len(self.filtered_node_ids) == 0 or
-                             node[1].id not in self.filtered_node_ids[-1]):
-                continue
+        for node in self._root_nodes_window(filtered, start, count):
             tree.append_child()
             tree.children[-1].id = node[1].id
             tree.children[-1].tier_id = node[1].id[node[1].id.find("..")+2:node[1].id.find("na")-2]
@@ -480,7 +868,7 @@ class AnnotationGraph():
         converter.meta_information = self.meta_information
         converter.write(outputfile)
 
-    def to_graf(self, outputfile):
+    def to_graf(self, outputfile, workers=None, processes=False):
         """Write the annotation graph as GrAX/XML files.
         
         Parameters
@@ -488,10 +876,17 @@ class AnnotationGraph():
         outputfile : str or io stream
             The path to the output file. This filename is the header file of the
             GrAF/XML files, it should have the extension ".hdr".
+        workers : int, optional
+            The number of threads or processes that render the files of the
+            tiers. If None the files are rendered one after another.
+        processes : bool, optional
+            Render the files in worker processes instead of threads, see
+            `poioapi.io.graf.Writer`.
 
         """
         converter = poioapi.io.graf.GrAFConverter(
-            None, poioapi.io.graf.Writer())
+            None, poioapi.io.graf.Writer(workers=workers,
+                processes=processes))
         converter.graf = self.graf
         converter.tier_hierarchies = self.tier_hierarchies
         converter.meta_information = self.meta_information
@@ -568,12 +963,13 @@ class AnnotationGraph():
 
         filename = basedirname + "-extinfo.xml"
         file = open(filename, 'wb')
-        doc = minidom.parseString(tostring(element_tree))
-        file.write(doc.toprettyxml(indent='  ', encoding='utf-8'))
+        poioapi.io.xmlwriter.write_pretty_xml(file, element_tree,
+            indent='  ', encoding='utf-8')
         file.close()
 
     def append_filter(self, filter):
-        """Append a filter to the search.
+        """Append a filter to the search. The filter is only applied to the
+        root nodes that passed the previous filters.
 
         Parameters
         ----------
@@ -583,15 +979,20 @@ class AnnotationGraph():
         """
 
         self.filters.append(filter)
+        self.filtered_node_ids.append(self._apply_filter(filter))
+
+    def _apply_filter(self, filter):
+        """Return the IDs of the root nodes that pass the given filter and
+        all filters before it, in the order of the root nodes. The filter is
+        evaluated as a query on bitmaps of the root nodes.
 
-        new_filtered_elements = \
-            [ node.id
-            for node in self.root_nodes()
-                if (len(self.filtered_node_ids) == 0 or \
-                    node.id in self.filtered_node_ids[-1]) and \
-                    filter.element_passes_filter(node)]
+        """
 
-        self.filtered_node_ids.append(new_filtered_elements)
+        table = self.tier_value_table()
+        bitmap = filter.as_query().evaluate(table, filter.matchobject)
+        if len(self.filtered_node_ids) > 0:
+            bitmap &= table.bitmap_for_root_ids(self.filtered_node_ids[-1])
+        return table.root_ids_for_bitmap(bitmap)
 
     def last_filter(self):
         """Return the latest added filter.
@@ -611,7 +1012,8 @@ class AnnotationGraph():
             return AnnotationGraphFilter(self)
 
     def update_last_filter(self, filter):
-        """Update the last filter added.
+        """Update the last filter added. Only the result of the last filter
+        is computed again.
 
         Parameters
         ----------
@@ -646,24 +1048,100 @@ class AnnotationGraph():
         self.filters = []
         self.filtered_node_ids = []
 
-    def reset_filters(self):
-        """Reset the filters array.
+    def reset_filters(self, level=0):
+        """Reset the filters array. The results of all filters starting at
+        the given level are computed again, the results of the filters
+        before it are kept.
+
+        Parameters
+        ----------
+        level : int, optional
+            The index of the first filter to compute again.
+
+        """
+
+        del self.filtered_node_ids[level:]
+
+        for filter in self.filters[level:]:
+            self.filtered_node_ids.append(self._apply_filter(filter))
+
+    def tier_value_table(self):
+        """Return the table of the annotation values of the graph that the
+        queries are evaluated on. The table is built on the first call and
+        built again when the graph is replaced, after `build_indexes` or
+        when the data structure type changes.
+
+        Returns
+        -------
+        table : poioapi.query.TierValueTable
 
         """
 
-        self.filtered_node_ids = []
+        if self._tier_value_table is None or \
+                self._tier_value_table.is_stale():
+            self._tier_value_table = poioapi.query.TierValueTable(self)
+        return self._tier_value_table
 
-        for filter in self.filters:
-            new_filtered_elements = []
-            for node in self.root_nodes():
-                if (len(self.filtered_node_ids) == 0 or \
-                        node.id in self.filtered_node_ids[-1]) and \
-                        filter.element_passes_filter(node):
-                    new_filtered_elements.append(node.id)
+    def query(self, query):
+        """Return the root nodes that match a query. Queries are built from
+        the classes in `poioapi.query` and can combine predicates on several
+        tiers with `&`, `|` and `~`.
 
-            self.filtered_node_ids.append(new_filtered_elements)
+        Parameters
+        ----------
+        query : poioapi.query.Query
+            The query to evaluate.
+
+        Returns
+        -------
+        root_ids : list of str
+            The IDs of the matching root nodes, in the order of the root
+            nodes.
 
-    def create_filter_for_dict(self, search_dict):
+        """
+
+        table = self.tier_value_table()
+        return table.root_ids_for_bitmap(query.evaluate(table))
+
+    def build_search_index(self, ngram_size=3):
+        """Build an inverted index over the annotation values of the root
+        nodes. Once the index exists the filters use it to skip all root
+        nodes that cannot match before they run the regular expressions.
+        The index is rebuilt automatically when the graph is replaced,
+        after `build_indexes` or when the data structure type changes.
+
+        Parameters
+        ----------
+        ngram_size : int, optional
+            The length of the character n-grams in the index.
+
+        Returns
+        -------
+        search_index : AnnotationGraphIndex
+            The new index.
+
+        """
+
+        self.search_index = AnnotationGraphIndex(self, ngram_size)
+        return self.search_index
+
+    def current_search_index(self):
+        """Return the search index of the graph, or None if there was no
+        index built with `build_search_index`. The index is rebuilt first if
+        it is stale, see `AnnotationGraphIndex.is_stale`.
+
+        Returns
+        -------
+        search_index : AnnotationGraphIndex
+
+        """
+
+        if self.search_index is not None and self.search_index.is_stale():
+            self.search_index = AnnotationGraphIndex(
+                self, self.search_index.ngram_size)
+        return self.search_index
+
+    def create_filter_for_dict(self, search_dict, flags=0):
         """Creates a filter based on a give dict. The keys of the dict are
         matched against the data structure hierarchy. Only for those fields
         that are part of the data structure there will be a search term
@@ -673,6 +1151,9 @@ class AnnotationGraph():
         ----------
         search_dict : dict
             Dictionary with search terms for different tiers.
+        flags : int, optional
+            Flags for the regular expressions of the search terms, for
+            example `re.IGNORECASE`.
 
         Returns
         -------
@@ -683,10 +1164,80 @@ class AnnotationGraph():
         filter = AnnotationGraphFilter(self)
         for k in search_dict:
             if k in self.structure_type_handler.flat_data_hierarchy:
-                filter.set_filter_for_tier(k, search_dict[k])
+                filter.set_filter_for_tier(k, search_dict[k], flags)
         return filter
 
 
+class IntervalIndex():
+    """An index over the regions of a list of nodes. The nodes are sorted
+    by the start of their regions, and for each position the index keeps the
+    maximum end of all regions up to that position. Both lists are searched
+    with binary search.
+
+    """
+
+    def __init__(self, nodes):
+        """Class constructor.
+
+        Parameters
+        ----------
+        nodes : list of graf.Node
+            The nodes to index. Nodes without regions are ignored, regions
+            that end before their start are indexed with both swapped.
+
+        """
+
+        entries = []
+        for i, n in enumerate(nodes):
+            if n.links:
+                start, end = n.links[0][0].start, n.links[0][0].end
+                # the time slot interpolation of some Elan files produces
+                # regions that end before they start
+                if end < start:
+                    start, end = end, start
+                entries.append((start, end, i, n))
+        entries.sort()
+
+        self.starts = [e[0] for e in entries]
+        self.ends = [e[1] for e in entries]
+        self.nodes = [e[3] for e in entries]
+
+        self.max_ends = []
+        max_end = None
+        for end in self.ends:
+            if max_end is None or end > max_end:
+                max_end = end
+            self.max_ends.append(max_end)
+
+    def overlapping(self, start, end):
+        """Return the nodes whose regions overlap the range [start, end).
+        If start is equal to end return the nodes whose regions contain that
+        point.
+
+        """
+
+        first = bisect.bisect_right(self.max_ends, start)
+        if start == end:
+            last = bisect.bisect_right(self.starts, start)
+        else:
+            last = bisect.bisect_left(self.starts, end)
+
+        return [self.nodes[i] for i in range(first, last)
+                if self.ends[i] > start]
+
+    def contained(self, start, end):
+        """Return the nodes whose regions lie completely in the range
+        [start, end].
+
+        """
+
+        first = bisect.bisect_left(self.starts, start)
+        last = bisect.bisect_right(self.starts, end)
+
+        return [self.nodes[i] for i in range(first, last)
+                if self.ends[i] <= end]
+
+
 class AnnotationGraphFilter():
     """
     AnnotationGraphFilter tree-like structure constructor.
@@ -706,6 +1257,7 @@ class AnnotationGraphFilter():
         self.annotation_graph = annotation_graph
 
         self.filter = dict()
+        self._patterns = dict()
         for e in self.annotation_graph.structure_type_handler.flat_data_hierarchy:
             self.filter[e] = ""
 
@@ -723,8 +1275,9 @@ class AnnotationGraphFilter():
         for e in self.annotation_graph.structure_type_handler.flat_data_hierarchy:
             self.matchobject[e] = dict()
 
-    def set_filter_for_tier(self, ann_type, filter_string):
-        """Set a filter for a given type.
+    def set_filter_for_tier(self, ann_type, filter_string, flags=0):
+        """Set a filter for a given type. The filter string is a regular
+        expression that is compiled once when the filter is set.
 
         Parameters
         ----------
@@ -732,13 +1285,93 @@ class AnnotationGraphFilter():
             Value of the field in the data structure hierarchy, the tier name.
         filter_string : str
             String of the filter.
+        flags : int, optional
+            Flags for the regular expression, for example `re.IGNORECASE`.
 
         """
 
         self.filter[ann_type] = filter_string
+        if filter_string != "":
+            self._patterns[ann_type] = re.compile(filter_string, flags)
+        else:
+            self._patterns.pop(ann_type, None)
+
+    def _pattern_for_tier(self, ann_type):
+        """Return the compiled regular expression for a given type. The
+        expression is compiled again if the filter string was changed
+        directly in `self.filter`.
+
+        """
+
+        pattern = self._patterns.get(ann_type)
+        if pattern is None or pattern.pattern != self.filter[ann_type]:
+            flags = 0
+            if pattern is not None:
+                flags = pattern.flags
+            pattern = re.compile(self.filter[ann_type], flags)
+            self._patterns[ann_type] = pattern
+        return pattern
+
+    def match_spans(self, ann_type, annotation_value):
+        """Match the filter of a given type against an annotation value.
+
+        Parameters
+        ----------
+        ann_type : str
+            Value of the field in the data structure hierarchy, the tier name.
+        annotation_value : str
+            The annotation value to search in.
+
+        Returns
+        -------
+        spans : list of list of int
+            The start and end position of each match. The list is empty if
+            the filter does not match.
+
+        """
+
+        return [ [m.start(), m.end()] for m in
+            self._pattern_for_tier(ann_type).finditer(annotation_value) ]
+
+    def as_query(self):
+        """Return the filter as a query on the root nodes. A tier with a
+        filter string matches if the regular expression matches, a tier
+        without a filter string matches if it occurs below the root node.
+        The tiers are combined with the boolean operation of the filter.
+
+        Returns
+        -------
+        query : poioapi.query.Query
+
+        """
+
+        all_filter_empty = True
+        queries = []
+        for ann_type in self.filter:
+            if self.filter[ann_type] == "":
+                queries.append(poioapi.query.TierPresent(ann_type))
+            else:
+                all_filter_empty = False
+                queries.append(poioapi.query.TierMatch(
+                    ann_type, self._pattern_for_tier(ann_type)))
+
+        if all_filter_empty:
+            return poioapi.query.And()
+
+        if self.boolean_operation == self.AND:
+            query = poioapi.query.And(*queries)
+        else:
+            query = poioapi.query.Or(*queries)
+
+        if self.inverted:
+            query = poioapi.query.Not(query)
+
+        return query
 
     def element_passes_filter(self, node):
-        """Verify if a specific element passes in through a filter.
+        """Verify if a specific element passes in through a filter. This
+        method traverses the hierarchy below the given node, the annotation
+        graph evaluates filters for all root nodes at once with `as_query`.
 
         Parameters
         ----------
@@ -818,12 +1451,302 @@ class AnnotationGraphFilter():
                 if self.filter[t] != "":
                     if len(a_list) > 0:
                         a = self.annotation_graph.annotation_value_for_annotation(a_list[0])
-                        match = re.search(self.filter[t], a)
-                        if match:
-                            self.matchobject[t][node.id] =\
-                            [ [m.start(), m.end()] for m in re.finditer(
-                                self.filter[t], a) ]
+                        spans = self.match_spans(t, a)
+                        if len(spans) > 0:
+                            self.matchobject[t][node.id] = spans
 
                             result_dict[t] = True
                 else:
                     result_dict[t] = True
+
+
+
+class AnnotationGraphIndex():
+    """An inverted index over the annotation values of an annotation graph.
+
+    For each tier of the data structure type the index maps the tokens and
+    the character n-grams of the annotation values to the IDs of the root
+    nodes where they occur. The index only returns candidates for a search,
+    the filters still check each candidate with the regular expression.
+
+    """
+
+    def __init__(self, annotation_graph, ngram_size=3):
+        """Class constructor.
+
+        Parameters
+        ----------
+        annotation_graph : AnnotationGraph
+            The annotation graph to index.
+        ngram_size : int, optional
+            The length of the character n-grams in the index.
+
+        """
+
+        self.annotation_graph = annotation_graph
+        self.ngram_size = ngram_size
+
+        self.tokens = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+        self.ngrams = collections.defaultdict(
+            lambda: collections.defaultdict(set))
+
+        annotation_graph._load_tiers(
+            annotation_graph.structure_type_handler.flat_data_hierarchy)
+        annotation_graph._check_indexes()
+        self._graf = annotation_graph.graf
+        self._generation = annotation_graph._index_generation
+        self._hierarchy = \
+            annotation_graph.structure_type_handler.data_hierarchy
+
+        for root_node in annotation_graph.root_nodes():
+            self._index_node(root_node.id, root_node, self._hierarchy)
+
+    def is_stale(self):
+        """Check whether the graph was replaced, its indexes were built
+        again or its data structure type changed since the index was built.
+
+        Returns
+        -------
+        stale : bool
+
+        """
+
+        ag = self.annotation_graph
+        return self._graf is not ag.graf or \
+            self._generation != ag._index_generation or \
+            self._hierarchy != ag.structure_type_handler.data_hierarchy
+
+    def _index_node(self, root_id, node, hierarchy):
+        """Add the annotation values below a node to the index. The
+        traversal is the same as in `AnnotationGraphFilter._passes_filter`,
+        so the index contains exactly the values that the filter tests.
+
+        """
+
+        ag = self.annotation_graph
+        for t in hierarchy:
+            if type(t) is list:
+                for n in ag.nodes_for_tier(t[0], node):
+                    self._index_node(root_id, n, t)
+            else:
+                a_list = ag.annotations_for_tier(t, node)
+                if len(a_list) > 0:
+                    self._add_value(t, root_id,
+                        ag.annotation_value_for_annotation(a_list[0]))
+
+    def _add_value(self, tier_name, root_id, value):
+        if not value:
+            return
+
+        for token in re.findall(r"\w+", value, re.UNICODE):
+            self.tokens[tier_name][token].add(root_id)
+
+        ngrams = self.ngrams[tier_name]
+        if len(value) < self.ngram_size:
+            ngrams[value].add(root_id)
+        else:
+            for i in range(len(value) - self.ngram_size + 1):
+                ngrams[value[i:i + self.ngram_size]].add(root_id)
+
+    def candidates(self, tier_name, pattern):
+        """Return the IDs of the root nodes that might contain a match of
+        the pattern in the given tier.
+
+        Parameters
+        ----------
+        tier_name : str
+            The tier to search in.
+        pattern : regular expression object
+            The compiled search pattern.
+
+        Returns
+        -------
+        candidates : set of str or None
+            The IDs of the candidate root nodes, or None if the pattern
+            contains no literal text that the index can look up.
+
+        """
+
+        literals = _required_literals(pattern)
+        if not literals:
+            return None
+
+        result = None
+        for literal, is_token in literals:
+            if is_token:
+                root_ids = self.tokens[tier_name].get(literal, set())
+            else:
+                root_ids = self._candidates_for_substring(tier_name, literal)
+
+            if result is None:
+                result = set(root_ids)
+            else:
+                result &= root_ids
+
+            if len(result) == 0:
+                break
+
+        return result
+
+    def _candidates_for_substring(self, tier_name, literal):
+        ngrams = self.ngrams[tier_name]
+        n = self.ngram_size
+
+        if len(literal) >= n:
+            result = None
+            for i in range(len(literal) - n + 1):
+                root_ids = ngrams.get(literal[i:i + n], set())
+                if result is None:
+                    result = set(root_ids)
+                else:
+                    result &= root_ids
+                if len(result) == 0:
+                    break
+            return result
+
+        # short literals: every value that contains the literal has an
+        # n-gram (or is a short value) that contains it
+        result = set()
+        for ngram, root_ids in ngrams.items():
+            if literal in ngram:
+                result |= root_ids
+        return result
+
+
+def _required_literals(pattern):
+    """Return the literal strings that each match of a regular expression
+    must contain. The expression is scanned conservatively: only literal
+    runs at the top level of the expression are returned, groups,
+    character classes and escapes other than escaped punctuation end a
+    run, and a character followed by an optional quantifier is dropped.
+
+    Parameters
+    ----------
+    pattern : regular expression object
+        The compiled regular expression.
+
+    Returns
+    -------
+    literals : list of tuple
+        Pairs of the literal and whether the literal is surrounded by word
+        boundaries, i.e. matches a complete token. The list is empty if the
+        expression is case insensitive, contains an alternative at the top
+        level or sets flags inline.
+
+    """
+
+    if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return []
+
+    # the tokens of the index are unicode words, so a word boundary in the
+    # pattern only marks a token if the pattern is unicode, too
+    tokens_match_words = bool(pattern.flags & re.UNICODE)
+
+    text = pattern.pattern
+    length = len(text)
+
+    literals = []
+    current = []
+    left_boundary = False
+    previous_boundary = False
+    i = 0
+    while i < length:
+        c = text[i]
+        is_boundary = False
+        if c == "\\":
+            if i + 1 == length:
+                return []
+            c = text[i + 1]
+            i += 2
+            if c == "b":
+                is_boundary = True
+            elif not c.isalnum():
+                if len(current) == 0:
+                    left_boundary = previous_boundary
+                current.append(c)
+                previous_boundary = False
+                continue
+        elif c == "|":
+            return []
+        elif c in "*?{":
+            # the character before the quantifier is optional
+            if len(current) > 0:
+                current.pop()
+            if c == "{" and text.find("}", i) != -1:
+                i = text.find("}", i) + 1
+            else:
+                i += 1
+        elif c == "(":
+            if text[i + 1:i + 2] == "?" and text[i + 2:i + 3].isalpha():
+                return []
+            i = _skip_group(text, i)
+            if i == -1:
+                return []
+        elif c == "[":
+            i = _skip_class(text, i)
+        elif c in ".^$+)":
+            i += 1
+        else:
+            if len(current) == 0:
+                left_boundary = previous_boundary
+            current.append(c)
+            previous_boundary = False
+            i += 1
+            continue
+
+        if len(current) > 0:
+            literal = "".join(current)
+            literals.append((literal, tokens_match_words and left_boundary and
+                is_boundary and
+                re.match(r"^\w+$", literal, re.UNICODE) is not None))
+            current = []
+        previous_boundary = is_boundary
+
+    if len(current) > 0:
+        literals.append(("".join(current), False))
+
+    return literals
+
+
+def _skip_class(text, i):
+    """Return the position after the character class that starts at
+    position `i` of a regular expression.
+
+    """
+
+    i += 1
+    if text[i:i + 1] == "^":
+        i += 1
+    if text[i:i + 1] == "]":
+        i += 1
+    while i < len(text) and text[i] != "]":
+        if text[i] == "\\":
+            i += 1
+        i += 1
+    return i + 1
+
+
+def _skip_group(text, i):
+    """Return the position after the group that starts at position `i` of a
+    regular expression, or -1 if the group is not closed.
+
+    """
+
+    depth = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = _skip_class(text, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return -1
@@ -19,13 +19,15 @@ read-/writeable.
 from __future__ import absolute_import
 
 import collections
+import bisect
+import array
 
 import xml.etree.ElementTree as ET
 
-from xml.etree.ElementTree import Element, SubElement, tostring
-from xml.dom import minidom
+from xml.etree.ElementTree import Element, SubElement
 
 import poioapi.io.graf
+import poioapi.io.xmlwriter
 
 
 class ElanTier(poioapi.io.graf.Tier):
@@ -37,23 +39,329 @@ class ElanTier(poioapi.io.graf.Tier):
         self.annotation_space = linguistic_type
 
 
+class ElanTemplate(object):
+    """
+    The tier structure and the time alignable linguistic types of an Elan
+    file. Files that were created from the same Elan template share this
+    structure, so parsers that get the same dict of templates only build
+    it once. The GrAF converter stores the tier hierarchies of the files in
+    `tier_hierarchies`.
+
+    """
+
+    def __init__(self, tiers, linguistic_types):
+        """Class's constructor.
+
+        Parameters
+        ----------
+        tiers : array-like
+            The "TIER" elements of the file.
+        linguistic_types : array-like
+            The "LINGUISTIC_TYPE" elements of the file.
+
+        """
+
+        self.root_tiers = []
+        self.child_tiers = collections.defaultdict(list)
+        self.tiers_by_id = dict()
+
+        for t in tiers:
+            tier = ElanTier(
+                t.attrib['TIER_ID'], t.attrib['LINGUISTIC_TYPE_REF'])
+            self.tiers_by_id.setdefault(tier.name, tier)
+            if "PARENT_REF" in t.attrib:
+                self.child_tiers[t.attrib["PARENT_REF"]].append(tier)
+            else:
+                self.root_tiers.append(tier)
+
+        self.time_alignable_types = set(
+            l.attrib["LINGUISTIC_TYPE_ID"] for l in linguistic_types
+            if l.attrib.get('TIME_ALIGNABLE') == 'true')
+
+        self.tier_hierarchies = None
+
+
+def _template_key(tiers, linguistic_types):
+    """Return the key of the template of an Elan file. Files with the same
+    key have the same tier structure and time alignable linguistic types.
+
+    """
+
+    return (tuple((t.attrib['TIER_ID'], t.attrib['LINGUISTIC_TYPE_REF'],
+                   t.attrib.get('PARENT_REF')) for t in tiers),
+            tuple((l.attrib["LINGUISTIC_TYPE_ID"],
+                   l.attrib.get('TIME_ALIGNABLE')) for l in linguistic_types))
+
+
+def _annotation_record(element):
+    """Return the compact record of an annotation element: a tuple
+    (alignable, annotation_id, value, ref1, ref2). For alignable annotations
+    ref1 and ref2 are the time slots, for reference annotations they are
+    the "ANNOTATION_REF" and the "PREVIOUS_ANNOTATION" or None.
+
+    """
+
+    attrib = element.attrib
+    value = element.find('ANNOTATION_VALUE').text
+    if element.tag == "ALIGNABLE_ANNOTATION":
+        return (True, attrib['ANNOTATION_ID'], value,
+                attrib['TIME_SLOT_REF1'], attrib['TIME_SLOT_REF2'])
+    return (False, attrib['ANNOTATION_ID'], value,
+            attrib['ANNOTATION_REF'], attrib.get('PREVIOUS_ANNOTATION'))
+
+
+class AnnotationTable(object):
+    """
+    Columnar storage of the annotations of an Elan file. The annotations
+    are rows in parallel arrays: the annotation IDs, the indexes of the
+    tiers, the offsets of the values in one string buffer and the start and
+    end times of the alignable annotations. Annotation objects are only
+    created when the annotations of a tier are requested.
+
+    """
+
+    def __init__(self):
+        """Class's constructor.
+
+        """
+
+        self.ids = []
+        self.tiers = array.array('i')
+        self.tier_prefixes = []
+        self.value_offsets = array.array('l', [0])
+        self.values = ""
+        self.none_values = set()
+        self.aligned = bytearray()
+        self.starts = array.array('l')
+        self.ends = array.array('l')
+        self.previous = dict()
+
+        self._values = []
+        self._values_size = 0
+
+    def add_tier(self, linguistic_type, tier_id):
+        """Add a tier to the table.
+
+        Parameters
+        ----------
+        linguistic_type : str
+            The linguistic type of the tier.
+        tier_id : str
+            The ID of the tier.
+
+        Returns
+        -------
+        tier_index : int
+            The index of the tier in the table.
+
+        """
+
+        self.tier_prefixes.append("{0}{1}{2}".format(
+            linguistic_type, poioapi.io.graf.GRAFSEPARATOR, tier_id))
+        return len(self.tier_prefixes) - 1
+
+    def append(self, tier_index, annotation_id, value, start=None, end=None,
+               previous=None):
+        """Add an annotation to the table. Alignable annotations have a
+        start and end time, reference annotations can have the ID of the
+        previous annotation.
+
+        Returns
+        -------
+        row : int
+            The row of the annotation.
+
+        """
+
+        row = len(self.ids)
+        self.ids.append(annotation_id)
+        self.tiers.append(tier_index)
+
+        if value is None:
+            self.none_values.add(row)
+            value = ""
+        self._values.append(value)
+        self._values_size += len(value)
+        self.value_offsets.append(self._values_size)
+
+        if start is None:
+            self.aligned.append(0)
+            self.starts.append(0)
+            self.ends.append(0)
+        else:
+            self.aligned.append(1)
+            self.starts.append(start)
+            self.ends.append(end)
+
+        if previous is not None:
+            self.previous[row] = previous
+
+        return row
+
+    def finish(self):
+        """Join the annotation values into the string buffer. This must be
+        called after the last annotation was added.
+
+        """
+
+        self.values += "".join(self._values)
+        self._values = []
+
+    def value(self, row):
+        """Return the annotation value of a row.
+
+        """
+
+        if row in self.none_values:
+            return None
+        return self.values[self.value_offsets[row]:self.value_offsets[row + 1]]
+
+    def region(self, row):
+        """Return the start and end time of an alignable annotation.
+
+        """
+
+        return (self.starts[row], self.ends[row])
+
+    def annotation(self, row):
+        """Return the annotation of a row.
+
+        Parameters
+        ----------
+        row : int
+
+        Returns
+        -------
+        annotation : poioapi.io.graf.Annotation
+
+        """
+
+        features = {}
+        if row in self.previous:
+            prev_node = poioapi.io.graf.NodeId(
+                self.tier_prefixes[self.tiers[row]], self.previous[row])
+            features["previous_node"] = prev_node.to_str()
+
+        return poioapi.io.graf.Annotation(
+            self.ids[row], self.value(row), features)
+
+
+class RegionIndex(object):
+    """
+    Index of the time regions of the annotations of a tier, that finds
+    the first region that contains a given region. The index sorts the
+    regions by their start and keeps a binary indexed tree over them, where
+    each node stores the ends of its regions in sorted order together with
+    the lowest position of the regions in the input. A lookup then needs
+    O(log^2 n) steps instead of a scan over all regions.
+
+    """
+
+    def __init__(self, regions):
+        """Class's constructor.
+
+        Parameters
+        ----------
+        regions : iterable of tuple
+            Tuples (start, end, value). If several regions contain the
+            searched region, the value of the one that comes first is
+            returned.
+
+        """
+
+        self._values = []
+        entries = []
+        for position, (start, end, value) in enumerate(regions):
+            self._values.append(value)
+            entries.append((start, end, position))
+        entries.sort(key=lambda entry: entry[0])
+
+        self._starts = [start for start, _, _ in entries]
+
+        size = len(entries)
+        buckets = [[] for _ in range(size + 1)]
+        for i, (_, end, position) in enumerate(entries, 1):
+            while i <= size:
+                buckets[i].append((end, position))
+                i += i & -i
+
+        self._ends = []
+        self._first_positions = []
+        for bucket in buckets:
+            bucket.sort()
+            first_positions = [position for _, position in bucket]
+            for i in range(len(first_positions) - 2, -1, -1):
+                if first_positions[i + 1] < first_positions[i]:
+                    first_positions[i] = first_positions[i + 1]
+            self._ends.append([end for end, _ in bucket])
+            self._first_positions.append(first_positions)
+
+    def containing(self, start, end):
+        """Return the value of the first region with a start before or equal
+        to `start` and an end after or equal to `end`.
+
+        Parameters
+        ----------
+        start : int
+        end : int
+
+        Returns
+        -------
+        value : object
+            The value of the region or None if no region contains the
+            given region.
+
+        """
+
+        first = None
+        i = bisect.bisect_right(self._starts, start)
+        while i > 0:
+            k = bisect.bisect_left(self._ends[i], end)
+            if k < len(self._ends[i]):
+                position = self._first_positions[i][k]
+                if first is None or position < first:
+                    first = position
+            i -= i & -i
+
+        if first is None:
+            return None
+        return self._values[first]
+
+
 class Parser(poioapi.io.graf.BaseParser):
     """
     Class that will handle parse Elan files.
 
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, streaming=False, tiers=None,
+                 templates=None):
         """Class's constructor.
 
         Parameters
         ----------
         filepath : str
             Path of the elan file.
+        streaming : bool, optional
+            If True the file is read with `iterparse`. The annotation
+            elements are dropped from the element tree as soon as they are
+            read and only compact tuples of their values are kept, so large
+            files need much less memory.
+        tiers : list of str, optional
+            The IDs of the tiers to load. The parent tiers of the given tiers
+            are loaded as well. All tiers are loaded if this is None.
+        templates : dict, optional
+            A dict of the templates of already parsed files. If the file
+            has the same template as one of them, the tier structure of the
+            template is reused, otherwise the template of the file is added.
+            Pass the same dict to the parsers of a batch of files.
 
         """
 
         self.filepath = filepath
+        self.streaming = streaming
+        self.tier_names = tiers
+        self.templates = templates
         self._parse()
 
     def _parse(self):
@@ -65,14 +373,126 @@ class Parser(poioapi.io.graf.BaseParser):
         # With the python 2.x the element tree the strings
         # are somehow mixed with "str" and "unicode" types.
         # http://stackoverflow.com/questions/3418262/python-unicode-and-elementtree-parse
-        self.root = ET.parse(self.filepath)
-        self.tree = self.root.getroot()
+        if self.streaming:
+            self._stream_document()
+        else:
+            self.root = ET.parse(self.filepath)
+            self.tree = self.root.getroot()
+            self._annotation_records = None
+        self._index_tiers()
         self.time_order = self._map_time_slots()
-        self.annotations_for_parent = collections.defaultdict(list)
-        self.regions_map = {}
+        self.annotations = AnnotationTable()
+        self._rows_for_parent = collections.defaultdict(
+            lambda: array.array('i'))
+        self._region_rows = {}
+        self._region_indexes = {}
+        self._document_region_indexes = {}
         self.regions_cache = {}
         self.meta_information = self._retrieve_aditional_information()
         self._build_annotations()
+        self._annotation_records = None
+
+    def _stream_document(self):
+        """This helper method reads the EAF file with `iterparse`. The
+        element tree that is left contains everything but the annotations,
+        those are stored as annotation records for each tier element.
+
+        See also
+        --------
+        _annotation_record
+
+        """
+
+        self._annotation_records = dict()
+        elements = []
+        for event, element in ET.iterparse(
+                self.filepath, events=("start", "end")):
+            if event == "start":
+                elements.append(element)
+                continue
+
+            elements.pop()
+            if element.tag == "ANNOTATION" and len(elements) == 2 and \
+                    elements[1].tag == "TIER":
+                tier = elements[1]
+                records = self._annotation_records.setdefault(tier, [])
+                for a in element:
+                    records.append(_annotation_record(a))
+                tier.remove(element)
+            elif len(elements) == 0:
+                self.tree = element
+
+        self.root = ET.ElementTree(self.tree)
+
+    def _tier_annotations(self, tier):
+        """This helper method iterates over the annotations of a tier
+        element. It yields tuples of the annotation, that is the element in
+        the regions cache, and its annotation record.
+
+        """
+
+        if self._annotation_records is None:
+            for a in tier.findall("ANNOTATION/*"):
+                yield a, _annotation_record(a)
+        else:
+            for record in self._annotation_records.get(tier, []):
+                yield record[1], record
+
+    def _annotation_id(self, annotation):
+        """Return the ID of an annotation from the regions cache.
+
+        """
+
+        if self.streaming:
+            return annotation
+        return annotation.attrib['ANNOTATION_ID']
+
+    def _index_tiers(self):
+        """This helper method reads all tiers and linguistic types once and
+        builds the maps that the parser callbacks use: the tiers by id and
+        the template with the tier structure, that is taken from
+        `self.templates` if possible.
+
+        """
+
+        self._tiers = self.tree.findall("TIER")
+        if self.tier_names is not None:
+            self._tiers = self._select_tiers(self._tiers)
+        self._tiers_by_id = dict()
+
+        for t in self._tiers:
+            self._tiers_by_id.setdefault(t.attrib['TIER_ID'], t)
+
+        linguistic_types = self.tree.findall("LINGUISTIC_TYPE")
+        if self.templates is None:
+            self.template = ElanTemplate(self._tiers, linguistic_types)
+        else:
+            key = _template_key(self._tiers, linguistic_types)
+            if key not in self.templates:
+                self.templates[key] = ElanTemplate(
+                    self._tiers, linguistic_types)
+            self.template = self.templates[key]
+
+    def _select_tiers(self, tiers):
+        """This helper method returns the tiers with the IDs in
+        `self.tier_names` and all their parent tiers, in document order.
+
+        """
+
+        tiers_by_id = dict()
+        for t in tiers:
+            tiers_by_id.setdefault(t.attrib['TIER_ID'], t)
+
+        selected = set()
+        for name in self.tier_names:
+            if name not in tiers_by_id:
+                raise ValueError(
+                    "The specified tier does not exist: {0}".format(name))
+            while name in tiers_by_id and name not in selected:
+                selected.add(name)
+                name = tiers_by_id[name].attrib.get("PARENT_REF")
+
+        return [t for t in tiers if t.attrib['TIER_ID'] in selected]
 
     def get_root_tiers(self):
         """This method retrieves all the root tiers.
@@ -86,10 +506,7 @@ class Parser(poioapi.io.graf.BaseParser):
 
         """
 
-        return [ElanTier(
-                    tier.attrib['TIER_ID'], tier.attrib['LINGUISTIC_TYPE_REF'])
-                for tier in self.tree.findall('TIER')
-                if not 'PARENT_REF' in tier.attrib]
+        return list(self.template.root_tiers)
 
     def get_tier_by_name(self, name):
         """This method retrieves a tier by it's name.
@@ -100,10 +517,7 @@ class Parser(poioapi.io.graf.BaseParser):
             The tier with the given name.
 
         """
-        for tier in self.tree.findall('TIER'):
-            if tier.attrib['TIER_ID'] == name:
-                return ElanTier(
-                    tier.attrib['TIER_ID'], tier.attrib['LINGUISTIC_TYPE_REF'])
+        return self.template.tiers_by_id.get(name)
 
     def get_child_tiers_for_tier(self, tier):
         """This method retrieves all the child tiers
@@ -123,10 +537,7 @@ class Parser(poioapi.io.graf.BaseParser):
 
         """
 
-        return [ElanTier(t.attrib['TIER_ID'], t.attrib['LINGUISTIC_TYPE_REF'])
-                for t in self.tree.findall("TIER")
-                if "PARENT_REF" in t.attrib and
-                   t.attrib["PARENT_REF"] == tier.name]
+        return list(self.template.child_tiers.get(tier.name, []))
 
     def get_annotations_for_tier(self, tier, annotation_parent=None):
         """This method retrieves all the annotations
@@ -157,78 +568,76 @@ class Parser(poioapi.io.graf.BaseParser):
         parent_id = None
         if annotation_parent:
             parent_id = annotation_parent.id
-        return self.annotations_for_parent[(parent_id, tier.name)]
+        return [self.annotations.annotation(row) for row in
+                self._rows_for_parent.get((parent_id, tier.name), [])]
 
 
     def _build_annotations(self):
-        for t in self.tree.findall("TIER"):
+        for t in self._tiers:
             tier = ElanTier(
                 t.attrib['TIER_ID'], t.attrib['LINGUISTIC_TYPE_REF'])
+            tier_index = self.annotations.add_tier(
+                t.attrib['LINGUISTIC_TYPE_REF'], t.attrib['TIER_ID'])
             self.regions_cache[tier.name] = dict()
-            for a in t.findall("ANNOTATION/*"):
-                annotation_id = a.attrib['ANNOTATION_ID']
-                annotation_value = a.find('ANNOTATION_VALUE').text
-                features = {}
-
+            self._region_indexes.pop(tier.name, None)
+            for a, (alignable, annotation_id, annotation_value, ref1, ref2) \
+                    in self._tier_annotations(t):
                 parent_annotation_id = None
 
-                if a.tag == "ALIGNABLE_ANNOTATION":
-                    ts1 = a.attrib['TIME_SLOT_REF1']
-                    ts2 = a.attrib['TIME_SLOT_REF2']
+                if alignable:
+                    start = self.time_order[ref1]
+                    end = self.time_order[ref2]
+
+                    self.regions_cache[tier.name][(start, end)] = a
 
-                    self.regions_cache[tier.name][(
-                        self.time_order[ts1], self.time_order[ts2])] = a 
-                    
-                    self.regions_map[annotation_id] = \
-                        {'time_slot1': ts1,
-                         'time_slot2': ts2}
+                    row = self.annotations.append(tier_index, annotation_id,
+                        annotation_value, start, end)
+                    self._region_rows[annotation_id] = row
                     if 'PARENT_REF' in t.attrib:
                         parent = self._annotation_for_region(
-                            t.attrib['PARENT_REF'],
-                            self.time_order[ts1],
-                            self.time_order[ts2])
+                            t.attrib['PARENT_REF'], start, end)
 
                         if parent is not None:
-                            parent_annotation_id = \
-                                parent.attrib['ANNOTATION_ID']
+                            parent_annotation_id = self._annotation_id(parent)
                 else:
-                    parent_annotation_id = a.attrib["ANNOTATION_REF"]
-                    if "PREVIOUS_ANNOTATION" in a.attrib:
-                        prefix = "{0}{1}{2}".format(
-                            t.attrib['LINGUISTIC_TYPE_REF'],
-                            poioapi.io.graf.GRAFSEPARATOR,
-                            t.attrib['TIER_ID']
-                        )
-                        prev_node = poioapi.io.graf.NodeId(prefix,
-                            a.attrib["PREVIOUS_ANNOTATION"])
-                        features["previous_node"] = prev_node.to_str()
-
-                self.annotations_for_parent[(
-                    parent_annotation_id, t.attrib['TIER_ID'])].\
-                    append(poioapi.io.graf.Annotation(
-                        annotation_id, annotation_value, features))
+                    parent_annotation_id = ref1
+                    row = self.annotations.append(tier_index, annotation_id,
+                        annotation_value, previous=ref2)
+
+                self._rows_for_parent[(
+                    parent_annotation_id, t.attrib['TIER_ID'])].append(row)
+
+        self.annotations.finish()
 
     def _annotation_for_region(self, tier_name, start, end):
+        """Find the annotation of a tier whose time region contains the
+        given region. If the tier was already read, the first matching
+        region of the tier's regions cache wins, otherwise the first
+        matching annotation in the document.
+
+        """
+
         if tier_name in self.regions_cache:
-            for s, e in self.regions_cache[tier_name]:
-                if s <= start and e >= end:
-                    return self.regions_cache[tier_name][(s, e)]
-        else:
-            for t in self.tree.findall("TIER"):
-                if t.attrib['TIER_ID'] == tier_name:
-                    for a in t.findall("ANNOTATION/*"):
-                        annotation_regions = \
-                            [self.time_order[a.attrib['TIME_SLOT_REF1']],
-                             self.time_order[a.attrib['TIME_SLOT_REF2']]]
-                        if annotation_regions[0] <= start and \
-                                annotation_regions[1] >= end:
-                            return a
+            if tier_name not in self._region_indexes:
+                self._region_indexes[tier_name] = RegionIndex(
+                    (s, e, a) for (s, e), a in
+                    self.regions_cache[tier_name].items())
+            return self._region_indexes[tier_name].containing(start, end)
+        elif tier_name in self._tiers_by_id:
+            if tier_name not in self._document_region_indexes:
+                self._document_region_indexes[tier_name] = RegionIndex(
+                    (self.time_order[record[3]], self.time_order[record[4]], a)
+                    for a, record in self._tier_annotations(
+                        self._tiers_by_id[tier_name]) if record[0])
+            return self._document_region_indexes[tier_name].containing(
+                start, end)
         return None
 
     def region_for_annotation(self, annotation):
         """This method retrieves the region for a
         specific annotation. The region are obtained
-        through the time slots references.
+        from the start and end times in the annotation
+        table.
 
         Parameters
         ----------
@@ -242,12 +651,7 @@ class Parser(poioapi.io.graf.BaseParser):
 
         """
 
-        time_slot1 = self.regions_map[annotation.id]["time_slot1"]
-        time_slot2 = self.regions_map[annotation.id]["time_slot2"]
-
-        region = (self.time_order[time_slot1], self.time_order[time_slot2])
-
-        return region
+        return self.annotations.region(self._region_rows[annotation.id])
 
     def tier_has_regions(self, tier):
         """This method check if a tier has regions.
@@ -267,12 +671,7 @@ class Parser(poioapi.io.graf.BaseParser):
 
         """
 
-        for l in self.tree.findall("LINGUISTIC_TYPE"):
-            if l.attrib["LINGUISTIC_TYPE_ID"] == tier.linguistic_type:
-                if l.attrib['TIME_ALIGNABLE'] == 'true':
-                    return True
-
-        return False
+        return tier.linguistic_type in self.template.time_alignable_types
 
     def get_primary_data(self):
         """This method gets the information about
@@ -364,18 +763,45 @@ class Parser(poioapi.io.graf.BaseParser):
 
         See also
         --------
-        _find_time_slot_value
+        _time_slot_neighbours, _find_time_slot_value
 
         """
 
+        neighbours = None
         for time_slot, value in time_order_dict.items():
             if value is None:
+                if neighbours is None:
+                    neighbours = self._time_slot_neighbours()
                 time_order_dict[time_slot] = self._find_time_slot_value(
-                    time_slot, time_order_dict)
+                    time_slot, time_order_dict, neighbours)
 
         return time_order_dict
 
-    def _find_time_slot_value(self, time_slot, time_order_dict):
+    def _time_slot_neighbours(self):
+        """Helper function that maps each time slot to the time slots
+        that are used together with it in an alignable annotation. The
+        map is built in one pass over all annotations.
+
+        Returns
+        -------
+        neighbours : dict
+            A dictonary with the time slot's and the set of their
+            neighbours.
+
+        """
+
+        neighbours = collections.defaultdict(set)
+        for tier in self.tree.findall("TIER"):
+            for _, record in self._tier_annotations(tier):
+                if not record[0]:
+                    continue
+                ts1, ts2 = record[3:]
+                neighbours[ts1].add(ts2)
+                neighbours[ts2].add(ts1)
+
+        return neighbours
+
+    def _find_time_slot_value(self, time_slot, time_order_dict, neighbours):
         """Helper function to find and calculate the missing
         time value. The calculation is made base in the range
         where the time slot is used. The First it's obtain the
@@ -389,6 +815,9 @@ class Parser(poioapi.io.graf.BaseParser):
             Id of a "TIME_ORDER".
         time_order_dict : dict
             A dictonary with the time slot's and their values.
+        neighbours : dict
+            The neighbours of the time slots, as returned by
+            _time_slot_neighbours.
 
         Returns
         -------
@@ -397,24 +826,9 @@ class Parser(poioapi.io.graf.BaseParser):
 
         """
 
-        tiers = self.tree.findall('TIER')
-        range_time_slots = []
-
-        for tier in tiers:
-            annotations = tier.findall('ANNOTATION')
-            for annotation in annotations:
-                if annotation[0].tag == 'ALIGNABLE_ANNOTATION':
-                    if annotation[0].attrib['TIME_SLOT_REF1'] == time_slot:
-                        range_time_slots.append(
-                            annotation[0].attrib['TIME_SLOT_REF2'])
-                    if annotation[0].attrib['TIME_SLOT_REF2'] == time_slot:
-                        range_time_slots.append(
-                            annotation[0].attrib['TIME_SLOT_REF1'])
-
         time_slot_value = 0
-        range_time_slots = list(set(range_time_slots))
         count_values = 0
-        for time_slot in range_time_slots:
+        for time_slot in neighbours.get(time_slot, ()):
             if time_order_dict[time_slot] != None:
                 time_slot_value += time_order_dict[time_slot]
                 count_values = 0
@@ -439,12 +853,14 @@ class Parser(poioapi.io.graf.BaseParser):
         """
 
         meta_information = Element(self.root._root.tag, self.root._root.attrib)
+        tiers = set(self._tiers)
 
         for element in self.tree:
             if element.tag != 'ANNOTATION_DOCUMENT':
                 if element.tag == 'TIER':
-                    meta_information.append(Element(
-                        element.tag, element.attrib))
+                    if element in tiers:
+                        meta_information.append(Element(
+                            element.tag, element.attrib))
                 else:
                     parent_element = SubElement(meta_information, element.tag,
                                                 element.attrib)
@@ -496,37 +912,74 @@ class Writer(poioapi.io.graf.BaseWriter):
 
         self._time_slot_id = 0
         self.time_order = self._map_time_slots(converter.meta_information)
+        self._meta_tiers = self._map_meta_tiers(converter.meta_information)
+        self._previous_nodes = {}
 
-        for tier in self._flatten_hierarchy_elements(
-                converter.tier_hierarchies):
+        tiers = self._flatten_hierarchy_elements(converter.tier_hierarchies)
+        nodes_for_tier = self._nodes_for_tiers(converter.graf, tiers)
+
+        for tier in tiers:
             element = self._tier_in_meta_information(tier,
                 converter.meta_information)
             if element is not None:
-                for node in converter.graf.nodes:
-                    if node.id.startswith("{0}..".format(tier)):
-                        for ann in node.annotations:
+                for node in nodes_for_tier[tier]:
+                    for ann in node.annotations:
 
-                            annotation_value, ann_type, features = \
-                                self.get_annotation_values(node, ann)
+                        annotation_value, ann_type, features = \
+                            self.get_annotation_values(node, ann)
 
-                            annotation_element = SubElement(
-                                element, 'ANNOTATION')
-                            new_ann = SubElement(
-                                annotation_element, ann_type, features)
-                            SubElement(
-                                new_ann, 'ANNOTATION_VALUE').text = \
-                                annotation_value
+                        annotation_element = SubElement(
+                            element, 'ANNOTATION')
+                        new_ann = SubElement(
+                            annotation_element, ann_type, features)
+                        SubElement(
+                            new_ann, 'ANNOTATION_VALUE').text = \
+                            annotation_value
 
         self._write_file(outputfile, converter.primary_data,
             converter.meta_information)
 
-    def _tier_in_meta_information(self, tier, meta_information):
+    def _nodes_for_tiers(self, graf, tiers):
+        """Group the nodes of the graph by tier in one pass over the nodes.
+
+        Parameters
+        ----------
+        graf : object
+            A GrAF object.
+        tiers : array_like
+            The names of the tiers.
+
+        Returns
+        -------
+        nodes_for_tier : dict
+            A dictionary with the nodes of each tier, in the order of the
+            nodes in the graph.
+
+        """
+
+        nodes_for_tier = dict((tier, []) for tier in tiers)
+        for node in graf.nodes:
+            for tier in poioapi.io.graf.tier_prefixes(node.id):
+                if tier in nodes_for_tier:
+                    nodes_for_tier[tier].append(node)
+
+        return nodes_for_tier
+
+    def _map_meta_tiers(self, meta_information):
+        """Map the "TIER_ID"s of the meta information to their tier
+        elements.
+
+        """
+
+        meta_tiers = {}
         for et in meta_information.findall("TIER"):
-            if et.attrib["TIER_ID"] == tier.split(
-                    poioapi.io.graf.GRAFSEPARATOR)[1]:
-                return et
+            meta_tiers.setdefault(et.attrib["TIER_ID"], et)
 
-        return None
+        return meta_tiers
+
+    def _tier_in_meta_information(self, tier, meta_information):
+        return self._meta_tiers.get(
+            tier.split(poioapi.io.graf.GRAFSEPARATOR)[1])
 
     def get_annotation_values(self, node, ann):
         features = {'ANNOTATION_ID': ann.id}
@@ -572,20 +1025,42 @@ class Writer(poioapi.io.graf.BaseWriter):
 
     def _find_previous_annotation(self, node):
         parent = node.parent
+        prefix = node.id.rpartition(poioapi.io.graf.GRAFSEPARATOR)[0]
 
-        prev_node = None
-        neighbours = [child for child in parent.iter_children()
-                            if child.id.startswith(node.id.rpartition(
-                                poioapi.io.graf.GRAFSEPARATOR)[0])]
-        for neighbour in neighbours:
-            if neighbour.id == node.id:
-                break
-            prev_node = neighbour
+        key = (parent.id, prefix)
+        if key not in self._previous_nodes:
+            self._previous_nodes[key] = self._map_previous_nodes(
+                parent, prefix)
+        previous_nodes, last_node = self._previous_nodes[key]
+
+        prev_node = previous_nodes.get(node.id, last_node)
         if prev_node:
             return prev_node.annotations.get_first().id
 
         return None
 
+    def _map_previous_nodes(self, parent, prefix):
+        """Map the IDs of the children of a node, that start with the given
+        prefix, to the child that comes before them.
+
+        Returns
+        -------
+        previous_nodes : dict
+            The previous node for each node ID.
+        last_node : object
+            The last of the children.
+
+        """
+
+        previous_nodes = {}
+        prev_node = None
+        for child in parent.iter_children():
+            if child.id.startswith(prefix):
+                previous_nodes.setdefault(child.id, prev_node)
+                prev_node = child
+
+        return previous_nodes, prev_node
+
     def _write_file(self, outputfile, primary_data, element_tree):
         """Write and indent the element tree into a
         Elan file.
@@ -615,8 +1090,8 @@ class Writer(poioapi.io.graf.BaseWriter):
                            {"MEDIA_URL": primary_data.external_link,
                             "MIME_TYPE": primary_data.type})
 
-        doc = minidom.parseString(tostring(element_tree))
-        file.write(doc.toprettyxml(indent='    ', encoding='UTF-8'))
+        poioapi.io.xmlwriter.write_pretty_xml(file, element_tree,
+            indent='    ', encoding='UTF-8')
         file.close()
 
     def _flatten_hierarchy_elements(self, elements):
@@ -17,18 +17,49 @@ from __future__ import absolute_import, unicode_literals
 
 import abc
 import codecs
+import collections
+import copy
 import os
-
-from xml.etree.ElementTree import tostring
-from xml.dom import minidom
+import multiprocessing
+import multiprocessing.pool
+import xml.etree.ElementTree as ET
+import xml.sax
 
 import graf
+import graf.io
+
+import poioapi.io.xmlwriter
 
 # GrAF ID's separator
 GRAFSEPARATOR = ".."
 (TEXT, AUDIO, VIDEO, NONE, UNKNOWN) = ("text", "audio", "video", "none", "none")
 
 
+def tier_prefixes(node_id):
+    """Return all tier names that a node ID belongs to. A node belongs to a
+    tier if its ID starts with the tier name followed by the GrAF separator,
+    so the node "words..W-Words..na1" belongs to the tiers "words" and
+    "words..W-Words".
+
+    Parameters
+    ----------
+    node_id : str
+        The ID of a GrAF node.
+
+    Returns
+    -------
+    prefixes : list of str
+        The tier names of the node.
+
+    """
+    prefixes = []
+    pos = node_id.find(GRAFSEPARATOR)
+    while pos != -1:
+        prefixes.append(node_id[:pos])
+        pos = node_id.find(GRAFSEPARATOR, pos + 1)
+    return prefixes
+
+
 class Tier:
     """A list of tiers.
     The name is the tier unique identification.
@@ -296,6 +327,8 @@ class GrAFConverter:
         self.meta_information = None
         self.primary_data = None
         self.original_file = None
+        self.children_for_tier = {}
+        self._collect_hierarchy = True
 
     def write(self, outputfile):
         if self.writer:
@@ -304,29 +337,34 @@ class GrAFConverter:
     def parse(self):
         """This method will be the responsible to transform
         the parser into a GrAF object. This method also
-        retrieves the tiers hierarchies.
+        retrieves the tiers hierarchies. If the parser has a `template`
+        with the tier hierarchies of a file with the same tier structure,
+        the hierarchies are copied from the template, otherwise they are
+        stored in the template.
 
         """
 
-        self._tiers_parent_list = []
+        self._tiers_parent_set = set()
+        self._child_tiers_for_tier = collections.OrderedDict()
         self.root_tiers = []
-        tiers_hierarchy_map = {}
+
+        template = getattr(self.parser, 'template', None)
+        self._collect_hierarchy = template is None or \
+            template.tier_hierarchies is None
 
         for tier in self.parser.get_root_tiers():
             self.root_tiers.append(tier.name)
-            self._convert_tier(tier, None, None)
+            self._convert_tier(tier)
 
-        i = 0
-        for t in self._tiers_parent_list:
-            if t[1] is None:
-                i += 1
-                tiers_hierarchy_map[str(i)] = [t[0]]
-            else:
-                self._append_tier_to_hierarchy(tiers_hierarchy_map[str(i)],
-                    t[1], t[0])
+        if self._collect_hierarchy:
+            self.tier_hierarchies.extend(self._build_tier_hierarchies())
 
-        for i, hierarchy in tiers_hierarchy_map.items():
-            self.tier_hierarchies.append(hierarchy)
+            if template is not None:
+                template.tier_hierarchies = copy.deepcopy(
+                    self.tier_hierarchies)
+        else:
+            self.tier_hierarchies.extend(
+                copy.deepcopy(template.tier_hierarchies))
 
         if hasattr(self.parser, 'meta_information'):
             self.meta_information = self.parser.meta_information
@@ -336,8 +374,54 @@ class GrAFConverter:
                 isinstance(self.parser.filepath, str):
             self.original_file = os.path.abspath(self.parser.filepath)
 
-    def _convert_tier(self, tier, parent_node, parent_annotation,
+    def _convert_tier(self, tier, parent_node=None, parent_annotation=None,
             parent_prefix=None):
+        """Convert the annotations of a tier and of all its child tiers
+        into nodes of the graph. The tiers are traversed depth first with an
+        explicit stack of tier visits, so deep tier hierarchies do not
+        recurse. The nodes, edges, regions and annotations are collected
+        during the traversal and added to the graph at the end, the edges
+        after the nodes so that the nodes keep the order in which they were
+        created.
+
+        Parameters
+        ----------
+        tier : poioapi.io.graf.Tier
+            The tier to convert.
+        parent_node : graf.Node, optional
+            The node of the parent annotation.
+        parent_annotation : poioapi.io.graf.Annotation, optional
+            The parent annotation whose child annotations are converted.
+        parent_prefix : str, optional
+            The prefix of the node IDs of the parent tier.
+
+        """
+
+        self._new_nodes = []
+        self._new_edges = []
+        self._new_regions = []
+        self._new_annotations = collections.OrderedDict()
+        self._new_roots = []
+
+        stack = [self._visit_tier(tier, parent_node, parent_annotation,
+            parent_prefix)]
+        while stack:
+            for child_visit in stack[-1]:
+                stack.append(self._visit_tier(*child_visit))
+                break
+            else:
+                stack.pop()
+
+        self._add_new_elements()
+
+    def _visit_tier(self, tier, parent_node, parent_annotation,
+            parent_prefix):
+        """Convert the annotations of a tier for one parent annotation. This
+        is a generator that yields the arguments of the visits of the child
+        tiers, after the node of each annotation was created.
+
+        """
+
         child_tiers = self.parser.get_child_tiers_for_tier(tier)
 
         if tier.annotation_space is None:
@@ -354,96 +438,197 @@ class GrAFConverter:
         if self.parser.tier_has_regions(tier):
             has_regions = True
 
-        self._add_tier_in_hierarchy_list(prefix, parent_prefix)
+        if self._collect_hierarchy:
+            self._add_tier_in_hierarchy_list(prefix, parent_prefix)
 
         annotations = self.parser.get_annotations_for_tier(tier,
             parent_annotation)
 
+        is_root = prefix in self.root_tiers
+        tier_names = tier_prefixes(prefix + GRAFSEPARATOR)
+
         for annotation in annotations:
             regions = None
 
             if has_regions:
                 regions = self.parser.region_for_annotation(annotation)
 
-            node_id = NodeId(prefix, annotation.id)
-            self._add_node(node_id, annotation, annotation_name, regions,
-                parent_node)
-            self._add_root_nodes(prefix, node_id)
+            node = self._add_node(prefix, tier_names, annotation,
+                annotation_name, regions, parent_node)
+            if is_root:
+                self._new_roots.append(node.id)
 
             if child_tiers:
                 for t in child_tiers:
-                    self._convert_tier(t, node_id, annotation, prefix)
+                    yield (t, node, annotation, prefix)
 
         if annotations == [] and child_tiers:
             for t in child_tiers:
-                self._convert_tier(t, None, None, prefix)
+                yield (t, None, None, prefix)
 
     def _add_tier_in_hierarchy_list(self, prefix, parent_prefix):
-        if not (prefix, parent_prefix) in self._tiers_parent_list:
-            self._tiers_parent_list.append((prefix, parent_prefix))
+        if (prefix, parent_prefix) not in self._tiers_parent_set:
+            self._tiers_parent_set.add((prefix, parent_prefix))
+            self._child_tiers_for_tier.setdefault(parent_prefix, []).append(
+                prefix)
+
+    def _build_tier_hierarchies(self):
+        """Build the tier hierarchies from the child tiers that were
+        collected for each tier during the conversion. There is one
+        hierarchy for each root tier. A hierarchy is a list that starts
+        with the tier name, followed by one such list for each child tier,
+        in the order in which the child tiers were found.
 
-    def _append_tier_to_hierarchy(self, tiers_list, parent_tier, tier):
-        for t in tiers_list:
-            if isinstance(t, list):
-                self._append_tier_to_hierarchy(t, parent_tier, tier)
-            else:
-                if t == parent_tier:
-                    tiers_list.append([tier])
-
-    def _add_node(self, node_id, annotation, annotation_name, regions,
-            from_node_id):
-        self._add_node_to_graph(node_id, regions, from_node_id)
-        self._add_graf_annotation(annotation_name, annotation.id, node_id,
-                                  annotation.value, annotation.features)
+        Returns
+        -------
+        tier_hierarchies : list of list
+            The tier hierarchies.
 
-    def _add_root_nodes(self, prefix, node_id):
-        if prefix in self.root_tiers:
-            self.graf.header.roots.append(node_id.to_str())
+        """
 
-    def _add_graf_annotation(self, annotation_name, annotation_id,
-            annotation_ref, annotation_value, annotation_features=None):
-        annotation = graf.Annotation(annotation_name, annotation_features,
-                                     annotation_id)
+        tier_hierarchies = []
+        for root_tier in self._child_tiers_for_tier.get(None, []):
+            hierarchy = [root_tier]
+            stack = [hierarchy]
+            while stack:
+                tiers_list = stack.pop()
+                for child_tier in self._child_tiers_for_tier.get(
+                        tiers_list[0], []):
+                    child_list = [child_tier]
+                    tiers_list.append(child_list)
+                    stack.append(child_list)
+            tier_hierarchies.append(hierarchy)
+
+        return tier_hierarchies
+
+    def _add_node(self, prefix, tier_names, annotation, annotation_name,
+            regions=None, parent_node=None):
+        """Create the node, edge, region and annotation for an annotation.
+        The elements are added to the graph later in `_add_new_elements`.
 
-        if annotation_value is not None:
-            annotation.features['annotation_value'] = annotation_value
+        Parameters
+        ----------
+        prefix : str
+            The prefix of the node ID, i.e. the tier name.
+        tier_names : list of str
+            The tier names of the nodes of the tier, as returned by
+            `tier_prefixes`.
+        annotation : poioapi.io.graf.Annotation
+            The annotation to create the node for.
+        annotation_name : str
+            The name of the annotation space of the annotation.
+        regions : list, optional
+            The anchors of the region of the annotation.
+        parent_node : graf.Node, optional
+            The node of the parent annotation.
 
-        self.graf.nodes[annotation_ref.to_str()].annotations.add(annotation)
+        Returns
+        -------
+        node : graf.Node
+            The new node.
 
-        if annotation_name in self.graf.annotation_spaces:
-            #if annotation not in self.graf.annotation_spaces[annotation_name]:
-            self.graf.annotation_spaces[annotation_name].add(annotation)
-        else:
-            annotation_space = graf.AnnotationSpace(annotation_name)
-            annotation_space.add(annotation)
+        """
 
-            self.graf.annotation_spaces.add(annotation_space)
+        index = str(annotation.id)
+        node_id = "{0}{1}n{2}".format(prefix, GRAFSEPARATOR, index)
+        node = graf.Node(node_id)
 
-    def _add_node_to_graph(self, node_id, regions=None,
-                           from_node_id=None):
+        if parent_node is not None:
+            self._new_edges.append((parent_node, node, "e{0}".format(index)))
 
-        node = graf.Node(node_id.to_str())
+            if GRAFSEPARATOR in index:
+                tier_names = tier_prefixes(node_id)
+            children = self.children_for_tier.setdefault(parent_node.id,
+                collections.defaultdict(list))
+            for tier_name in tier_names:
+                children[tier_name].append(node)
 
-        if from_node_id is not None:
-            edge_id = node_id.str_edge()
-            self.graf.create_edge(self.graf.nodes[from_node_id.to_str()], node,
-                edge_id)
+        # a node that replaces another one with the same ID has no children
+        self.children_for_tier.pop(node_id, None)
 
         if regions is not None:
-            region_id = node_id.str_region()
-            region = graf.Region(region_id, *regions)
+            region = graf.Region("{0}{1}r{2}".format(prefix, GRAFSEPARATOR,
+                index), *regions)
             node.add_region(region)
+            self._new_regions.append(region)
+
+        self._new_nodes.append(node)
+
+        graf_annotation = graf.Annotation(annotation_name,
+            annotation.features, annotation.id)
+        if annotation.value is not None:
+            graf_annotation.features['annotation_value'] = annotation.value
+        node.annotations.add(graf_annotation)
+        self._new_annotations.setdefault(annotation_name, []).append(
+            graf_annotation)
+
+        return node
+
+    def _add_new_elements(self):
+        """Add the elements that were created by `_add_node` to the graph, in
+        the order in which they were created. The edges are created after
+        all nodes were added, as creating an edge also adds its nodes to the
+        graph.
+
+        """
+
+        self.graf.nodes.update((node.id, node) for node in self._new_nodes)
+        for parent_node, node, edge_id in self._new_edges:
+            self.graf.create_edge(parent_node, node, edge_id)
+        self.graf.regions.update(
+            (region.id, region) for region in self._new_regions)
+
+        for annotation_name, annotations in self._new_annotations.items():
+            if annotation_name in self.graf.annotation_spaces:
+                annotation_space = \
+                    self.graf.annotation_spaces[annotation_name]
+            else:
+                annotation_space = graf.AnnotationSpace(annotation_name)
+                self.graf.annotation_spaces.add(annotation_space)
+            for annotation in annotations:
+                annotation_space.add(annotation)
+
+        self.graf.header.roots.extend(self._new_roots)
+
+        self._new_nodes = []
+        self._new_edges = []
+        self._new_regions = []
+        self._new_annotations = collections.OrderedDict()
+        self._new_roots = []
 
-            self.graf.regions.add(region)
 
-        self.graf.nodes.add(node)
+# The writer and graph that forked worker processes render from
+_forked_render_job = None
+
+
+def _render_tier_in_fork(job):
+    writer, graph = _forked_render_job
+    writer._render_tier(graph, *job)
 
 
 class Writer(BaseWriter):
 
-    def __init__(self, **kwargs):
+    def __init__(self, workers=None, processes=False, **kwargs):
+        """Class's constructor.
+
+        Parameters
+        ----------
+        workers : int, optional
+            The number of threads or processes that render the files of the
+            tiers. If None the files are rendered one after another.
+        processes : bool, optional
+            Render the files in worker processes instead of threads. The
+            worker processes are forked, so they do not need to copy the
+            graph. Threads are used if the platform cannot fork.
+        kwargs
+            The arguments of the GrAF standoff header.
+
+        """
+
         self.tier_hierarchies = None
         self.meta_information = None
+        self.workers = workers
+        self.processes = processes
         self.standoffheader = graf.StandoffHeader(**kwargs)
 
     def _flatten_hierarchy_elements(self, elements):
@@ -490,41 +675,130 @@ class Writer(BaseWriter):
         standoffrenderer = graf.StandoffHeaderRenderer("{0}.hdr".format(
             basedirname))
 
-        for tier_name in self._flatten_hierarchy_elements(
-                ag.tier_hierarchies):
+        tier_names = self._flatten_hierarchy_elements(ag.tier_hierarchies)
+        self._partition_graph(ag.graf, tier_names)
+
+        # tiers of the same annotation space are written to the same file,
+        # so only the last of them has to be rendered
+        tier_for_file = collections.OrderedDict()
+        for tier_name in tier_names:
             annotation_space = tier_name.split(GRAFSEPARATOR)[0]
-            out_graf = graf.Graph()
-            renderer = graf.GrafRenderer("{0}-{1}.xml".format(
-                basedirname, annotation_space
-            ))
-            out_graf.nodes = [n for n in ag.graf.nodes
-                              if n.id.startswith(tier_name)]
-            out_graf.edges = [e for e in ag.graf.edges
-                              if e.to_node.id.startswith(tier_name)]
-            out_graf.regions = [r for r in ag.graf.regions
-                                if r.id.startswith(tier_name)]
-            out_graf.annotation_spaces.add(graf.AnnotationSpace(
-                annotation_space))
-            out_graf.header.add_dependency(self._parent[tier_name])
-
-            out_graf = self._add_root_nodes(ag.graf, annotation_space,
-                out_graf)
-
-            renderer.render(out_graf)
+            tier_for_file["{0}-{1}.xml".format(
+                basedirname, annotation_space)] = tier_name
 
             basename = os.path.basename(basedirname)
             self.standoffheader.datadesc.add_annotation(
                 "{0}-{1}.xml".format(basename, annotation_space),
                 annotation_space)
 
+        self._render_tiers(ag.graf, [(tier_name, filename)
+            for filename, tier_name in tier_for_file.items()])
+
         self._add_primary_data(ag.primary_data, basedirname)
         standoffrenderer.render(self.standoffheader)
         self._generate_metafile(basedirname, ag.meta_information)
 
-    def _add_root_nodes(self, graph, annotation_space, out_graf):
+    def _render_tiers(self, graph, jobs):
+        """Render the files of the tiers, in a pool of threads or processes
+        if `self.workers` is set. The method returns when all files are
+        written.
+
+        Parameters
+        ----------
+        graph : graf.Graph
+            The graph of the tiers.
+        jobs : array_like
+            Tuples of the tier name and the name of the output file.
+
+        """
+
+        if not self.workers:
+            for tier_name, outputfile in jobs:
+                self._render_tier(graph, tier_name, outputfile)
+            return
+
+        global _forked_render_job
+
+        context = None
+        if self.processes:
+            try:
+                context = multiprocessing.get_context("fork")
+            except (AttributeError, ValueError):
+                pass
+
+        if context is not None:
+            _forked_render_job = (self, graph)
+            pool = context.Pool(self.workers)
+            try:
+                pool.map(_render_tier_in_fork, jobs)
+            finally:
+                pool.close()
+                pool.join()
+                _forked_render_job = None
+        else:
+            pool = multiprocessing.pool.ThreadPool(self.workers)
+            try:
+                pool.map(lambda job: self._render_tier(graph, *job), jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+    def _render_tier(self, graph, tier_name, outputfile):
+        """Render the nodes, edges and regions of one tier as a GrAF/XML
+        file.
+
+        """
+
+        annotation_space = tier_name.split(GRAFSEPARATOR)[0]
+        out_graf = graf.Graph()
+        out_graf.nodes = self._nodes[tier_name]
+        out_graf.edges = self._edges[tier_name]
+        out_graf.regions = self._regions[tier_name]
+        out_graf.annotation_spaces.add(graf.AnnotationSpace(
+            annotation_space))
+        out_graf.header.add_dependency(self._parent[tier_name])
+
+        out_graf = self._add_root_nodes(graph, annotation_space, out_graf)
+
+        renderer = graf.GrafRenderer(outputfile)
+        renderer.render(out_graf)
+
+    def _partition_graph(self, graph, tier_names):
+        """Partition the nodes, edges and regions of the graph by tier and
+        the root nodes by annotation space, with one pass over each of
+        them. Nodes and regions belong to a tier if their ID starts with the
+        tier name followed by the GrAF separator, edges belong to the tier
+        of their target node.
+
+        Parameters
+        ----------
+        graph : graf.Graph
+            The graph to partition.
+        tier_names : array_like
+            The names of the tiers.
+
+        """
+
+        self._nodes = self._partition(graph.nodes, tier_names)
+        self._edges = self._partition(graph.edges, tier_names,
+            lambda e: e.to_node.id)
+        self._regions = self._partition(graph.regions, tier_names)
+
+        self._roots = collections.defaultdict(list)
         for root in graph.header.roots:
-            if annotation_space in root:
-                out_graf.header.roots.append(root)
+            self._roots[root.split(GRAFSEPARATOR)[0]].append(root)
+
+    def _partition(self, elements, tier_names, element_id=lambda e: e.id):
+        partitions = dict((tier_name, []) for tier_name in tier_names)
+        for element in elements:
+            for tier_name in tier_prefixes(element_id(element)):
+                if tier_name in partitions:
+                    partitions[tier_name].append(element)
+
+        return partitions
+
+    def _add_root_nodes(self, graph, annotation_space, out_graf):
+        out_graf.header.roots.extend(self._roots.get(annotation_space, []))
 
         return out_graf
 
@@ -579,7 +853,107 @@ class Writer(BaseWriter):
 
         if meta_information is not None:
             out = open("{0}-extinfo.xml".format(basedirname), "wb")
-            doc = minidom.parseString(tostring(meta_information,
-                encoding="utf-8"))
-            out.write(doc.toprettyxml(encoding='utf-8'))
+            poioapi.io.xmlwriter.write_pretty_xml(out, meta_information,
+                encoding='utf-8')
             out.close()
+
+
+class LazyGraphLoader(object):
+    """Load the annotation files of a GrAF header into a graph on demand.
+    The header is read when the loader is created, but the file of an
+    annotation space is only parsed when the annotation space is loaded for
+    the first time. The files that an annotation file depends on are loaded
+    before it, each file is parsed only once.
+
+    """
+
+    def __init__(self, header_file, graph=None):
+        """Class's constructor.
+
+        Parameters
+        ----------
+        header_file : str or file object
+            The GrAF header (.hdr) file.
+        graph : graf.Graph, optional
+            The graph to load the annotation files into. A new graph is
+            created if None.
+
+        """
+
+        if hasattr(header_file, "read"):
+            filename = header_file.name
+            tree = ET.parse(header_file)
+        else:
+            filename = header_file
+            tree = ET.parse(filename)
+
+        self.dirname = os.path.dirname(filename)
+        self.files = collections.OrderedDict()
+        for element in tree.iter():
+            if element.tag.rpartition("}")[2] == "annotation":
+                self.files[element.get("f.id")] = os.path.join(self.dirname,
+                    element.get("loc"))
+
+        if graph is None:
+            graph = graf.Graph()
+        self.graph = graph
+        self.loaded = set()
+
+    def load_tier(self, tier_name):
+        """Load the annotation file of the annotation space of a tier, if it
+        was not loaded yet.
+
+        Parameters
+        ----------
+        tier_name : str
+            The name of the tier, the part before the first GrAF separator is
+            the annotation space. Tiers without an annotation file in the
+            header are ignored.
+
+        Returns
+        -------
+        loaded : bool
+            True if an annotation file was loaded into the graph.
+
+        """
+
+        return self.load(tier_name.split(GRAFSEPARATOR)[0])
+
+    def load(self, annotation_space):
+        """Load the annotation file of an annotation space and the files it
+        depends on, if they were not loaded yet.
+
+        Parameters
+        ----------
+        annotation_space : str
+            The ID of the annotation file in the header. Unknown IDs are
+            ignored.
+
+        Returns
+        -------
+        loaded : bool
+            True if an annotation file was loaded into the graph.
+
+        """
+
+        if annotation_space in self.loaded or \
+                annotation_space not in self.files:
+            return False
+        self.loaded.add(annotation_space)
+
+        parser = xml.sax.make_parser()
+        handler = graf.io.GraphHandler(parser, self.graph,
+            lambda name, graph: self.load(name))
+        parser.setContentHandler(handler)
+        parser.parse(self.files[annotation_space])
+
+        return True
+
+    def load_all(self):
+        """Load all annotation files of the header, in the order of the
+        header.
+
+        """
+
+        for annotation_space in self.files:
+            self.load(annotation_space)
@@ -14,9 +14,9 @@
 from __future__ import unicode_literals
 
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 
 import poioapi.io.graf
+import poioapi.io.xmlwriter
 
 
 class Parser(poioapi.io.graf.BaseParser):
@@ -221,8 +221,7 @@ class Writer(poioapi.io.graf.BaseWriter):
         if not hasattr(stream, 'read'):
             stream = open(outputfile, 'wb')
             was_stream = False
-        doc = minidom.parseString(ET.tostring(self.root))
-        str_content = doc.toprettyxml(indent='    ', encoding='UTF-8')
-        stream.write(str_content)
+        poioapi.io.xmlwriter.write_pretty_xml(stream, self.root,
+            indent='    ', encoding='UTF-8')
         if not was_stream:
             stream.close()
\ No newline at end of file
@@ -20,10 +20,9 @@ import time
 import datetime
 import re
 import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import tostring
-from xml.dom import minidom
 
 import poioapi.io.graf
+import poioapi.io.xmlwriter
 import poioapi.annotationgraph
 import poioapi.data
 import poioapi.mapper
@@ -626,13 +625,8 @@ class Writer(poioapi.io.graf.BaseWriter):
         """
 
         if pretty_print:
-            doc = minidom.parseString(tostring(root))
-
-            text_re = re.compile(r'>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
-            pretty_xml = text_re.sub(r'>\g<1></', doc.toprettyxml(indent='  '))
-
             file = codecs.open(outputfile, 'wb', encoding='utf-8')
-            file.write(pretty_xml)
+            poioapi.io.xmlwriter.write_pretty_xml(file, root, indent='  ')
             file.close()
         else:
             tree = ET.ElementTree(root)
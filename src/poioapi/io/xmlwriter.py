@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Poio Tools for Linguists
+#
+# Copyright (C) 2009-2013 Poio Project
+# URL: <http://media.cidles.eu/poio/>
+# For license information, see LICENSE.TXT
+"""This module contains a pretty printing XML writer for element trees that
+is shared by the writers. The output has the same layout as the one of
+`xml.dom.minidom` for the serialized tree, but the document is written in
+chunks while the tree is traversed, so no serialized copy or DOM of the
+whole document is kept in memory.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import xml.etree.ElementTree as ET
+
+BUFFER_SIZE = 65536
+
+# The prefixes that ElementTree uses for well known namespaces
+NAMESPACE_PREFIXES = {
+    "http://www.w3.org/XML/1998/namespace": "xml",
+    "http://www.w3.org/1999/xhtml": "html",
+    "http://www.w3.org/1999/02/22-rdf-syntax-ns#": "rdf",
+    "http://schemas.xmlsoap.org/wsdl/": "wsdl",
+    "http://www.w3.org/2001/XMLSchema": "xs",
+    "http://www.w3.org/2001/XMLSchema-instance": "xsi",
+    "http://purl.org/dc/elements/1.1/": "dc",
+}
+
+# Set the type of string
+if sys.version_info[:2] >= (3, 0):
+    string_type = str
+else:
+    string_type = basestring
+
+
+def write_pretty_xml(stream, element, indent="\t", newl="\n", encoding=None):
+    """Write an element tree as pretty printed XML.
+
+    Parameters
+    ----------
+    stream : file object
+        The stream to write to. If an encoding is given, this must be a
+        binary stream, otherwise a text stream.
+    element : xml.etree.ElementTree.Element
+        The root element.
+    indent : str, optional
+        The indentation that is added for each level of the tree.
+    newl : str, optional
+        The string that is written at the end of each line.
+    encoding : str, optional
+        The encoding of the output. It is also written to the XML
+        declaration.
+
+    """
+
+    writer = _ChunkWriter(stream, encoding)
+    if encoding:
+        writer.write('<?xml version="1.0" encoding="{0}"?>{1}'.format(
+            encoding, newl))
+    else:
+        writer.write('<?xml version="1.0" ?>{0}'.format(newl))
+
+    qnames, namespaces = _namespaces(element)
+    _write_element(writer, element, qnames, namespaces, "", indent, newl)
+    writer.flush()
+
+
+def _namespaces(element):
+    """Collect the qualified names and the namespaces of an element tree.
+    Names in the "{uri}local" notation get the prefix of their namespace,
+    the prefixes are assigned in the same way as in ElementTree: well
+    known namespaces get their usual prefix, all others get "ns0", "ns1"
+    and so on in the order of the tree.
+
+    Parameters
+    ----------
+    element : xml.etree.ElementTree.Element
+        The root element.
+
+    Returns
+    -------
+    qnames : dict
+        The qualified name for each tag and attribute name in the tree.
+    namespaces : dict
+        The prefix for each namespace URI that must be declared.
+
+    """
+
+    qnames = {None: None}
+    namespaces = {}
+
+    def add_qname(name):
+        if name[:1] != "{":
+            qnames[name] = name
+            return
+
+        uri, local_name = name[1:].rsplit("}", 1)
+        prefix = namespaces.get(uri)
+        if prefix is None:
+            prefix = NAMESPACE_PREFIXES.get(uri)
+            if prefix is None:
+                prefix = "ns{0}".format(len(namespaces))
+            if prefix != "xml":
+                namespaces[uri] = prefix
+        qnames[name] = "{0}:{1}".format(prefix, local_name)
+
+    for e in element.iter():
+        tag = e.tag
+        if isinstance(tag, ET.QName):
+            tag = tag.text
+        if isinstance(tag, string_type) and tag not in qnames:
+            add_qname(tag)
+        for key, value in e.items():
+            if isinstance(key, ET.QName):
+                key = key.text
+            if key not in qnames:
+                add_qname(key)
+            if isinstance(value, ET.QName) and value.text not in qnames:
+                add_qname(value.text)
+        if isinstance(e.text, ET.QName) and e.text.text not in qnames:
+            add_qname(e.text.text)
+
+    return qnames, namespaces
+
+
+class _ChunkWriter(object):
+    """Collect strings and write them to a stream in chunks of about
+    BUFFER_SIZE characters.
+
+    """
+
+    def __init__(self, stream, encoding=None):
+        self.stream = stream
+        self.encoding = encoding
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self._chunks)
+        if self.encoding:
+            data = data.encode(self.encoding, "xmlcharrefreplace")
+        self.stream.write(data)
+        self._chunks = []
+        self._size = 0
+
+
+def _escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;").\
+        replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _escape_text(data):
+    # XML parsers normalize line breaks in character data
+    return _escape(data.replace("\r\n", "\n").replace("\r", "\n"))
+
+
+def _write_element(writer, element, qnames, namespaces, level, indent, newl):
+    if element.tag is ET.Comment:
+        writer.write("{0}<!--{1}-->{2}".format(level, element.text, newl))
+        return
+
+    tag = qnames[element.tag]
+    writer.write(level + "<" + tag)
+
+    # namespace declarations come before all other attributes
+    if namespaces:
+        for uri, prefix in sorted(namespaces.items(), key=lambda x: x[1]):
+            if prefix:
+                prefix = ":" + prefix
+            writer.write(" xmlns{0}=\"{1}\"".format(prefix, _escape(uri)))
+    attributes = []
+    for key, value in element.items():
+        if isinstance(key, ET.QName):
+            key = key.text
+        if isinstance(value, ET.QName):
+            value = qnames[value.text]
+        name = qnames[key]
+        if name == "xmlns" or name.startswith("xmlns:"):
+            writer.write(" {0}=\"{1}\"".format(name, _escape(value)))
+        else:
+            attributes.append((name, value))
+    for name, value in attributes:
+        writer.write(" {0}=\"{1}\"".format(name, _escape(value)))
+
+    if len(element) == 0:
+        if element.text:
+            writer.write(">" + _escape_text(element.text))
+            writer.write("</{0}>{1}".format(tag, newl))
+        else:
+            writer.write("/>" + newl)
+        return
+
+    writer.write(">" + newl)
+    child_level = level + indent
+    if element.text:
+        writer.write(child_level + _escape_text(element.text) + newl)
+    for child in element:
+        _write_element(writer, child, qnames, None, child_level, indent, newl)
+        if child.tail:
+            writer.write(child_level + _escape_text(child.tail) + newl)
+    writer.write("{0}</{1}>{2}".format(level, tag, newl))
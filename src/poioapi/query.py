@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#
+# Poio Tools for Linguists
+#
+# Copyright (C) 2009-2013 Poio Project
+# Author: Peter Bouda <pbouda@cidles.eu>
+# URL: <http://media.cidles.eu/poio/>
+# For license information, see LICENSE.TXT
+"""This module contains the query layer for annotation graphs. A query is
+evaluated to a bitmap over the ordinals of the root nodes of the graph: bit
+`i` is set if the `i`-th root node matches. Queries can be combined with
+`&`, `|` and `~` (or with the classes And, Or and Not), so complex queries
+over several tiers only cost a few bitwise operations once the results of
+the single tier predicates are known. The bitmaps are Python integers.
+"""
+
+from __future__ import absolute_import, unicode_literals
+
+import binascii
+import collections
+import re
+
+
+def bitmap_from_ordinals(ordinals, size):
+    """Create a bitmap with the bits of the given ordinals set.
+
+    Parameters
+    ----------
+    ordinals : iterable of int
+        The ordinals of the bits to set.
+    size : int
+        The number of bits in the bitmap.
+
+    Returns
+    -------
+    bitmap : int
+
+    """
+
+    bits = bytearray((size + 7) // 8)
+    for i in ordinals:
+        bits[i >> 3] |= 1 << (i & 7)
+    bits.reverse()
+    return int(binascii.hexlify(bytes(bits)) or b"0", 16)
+
+
+def ordinals_from_bitmap(bitmap):
+    """Return the ordinals of all bits that are set in a bitmap, in
+    ascending order.
+
+    Parameters
+    ----------
+    bitmap : int
+
+    Returns
+    -------
+    ordinals : list of int
+
+    """
+
+    binary = bin(bitmap)[:1:-1]
+    ordinals = []
+    i = binary.find("1")
+    while i != -1:
+        ordinals.append(i)
+        i = binary.find("1", i + 1)
+    return ordinals
+
+
+class TierValueTable(object):
+    """A flat table of the annotation values of an annotation graph. For
+    each tier of the data structure type the table stores the annotation
+    values that a filter tests, together with the ordinal of their root
+    node. The table also stores for each tier a bitmap of the root nodes
+    where the tier occurs in the data structure hierarchy. Query results are
+    cached per tier and pattern.
+
+    """
+
+    def __init__(self, annotation_graph):
+        """Class constructor.
+
+        Parameters
+        ----------
+        annotation_graph : poioapi.annotationgraph.AnnotationGraph
+            The annotation graph to read the values from.
+
+        """
+
+        self.annotation_graph = annotation_graph
+        annotation_graph._load_tiers(
+            annotation_graph.structure_type_handler.flat_data_hierarchy)
+        annotation_graph._check_indexes()
+        self._graf = annotation_graph.graf
+        self._generation = annotation_graph._index_generation
+        self._hierarchy = \
+            annotation_graph.structure_type_handler.data_hierarchy
+
+        self.root_ids = annotation_graph.root_node_ids()
+        self.ordinals = annotation_graph.root_ordinals()
+        self.values = collections.defaultdict(list)
+        present = collections.defaultdict(set)
+
+        for ordinal, root_node in enumerate(annotation_graph.root_nodes()):
+            self._add_node(ordinal, root_node, self._hierarchy, present)
+
+        self.size = len(self.root_ids)
+        self.all = (1 << self.size) - 1
+        self.present = dict()
+        for tier_name in present:
+            self.present[tier_name] = bitmap_from_ordinals(
+                present[tier_name], self.size)
+
+        self._matches = dict()
+
+    def _add_node(self, ordinal, node, hierarchy, present):
+        ag = self.annotation_graph
+        for t in hierarchy:
+            if type(t) is list:
+                for n in ag.nodes_for_tier(t[0], node):
+                    self._add_node(ordinal, n, t, present)
+            else:
+                present[t].add(ordinal)
+                a_list = ag.annotations_for_tier(t, node)
+                if len(a_list) > 0:
+                    self.values[t].append((ordinal, node.id,
+                        ag.annotation_value_for_annotation(a_list[0])))
+
+    def is_stale(self):
+        """Check whether the graph was replaced, its indexes were built
+        again or its data structure type changed since the table was built.
+
+        Returns
+        -------
+        stale : bool
+
+        """
+
+        ag = self.annotation_graph
+        return self._graf is not ag.graf or \
+            self._generation != ag._index_generation or \
+            self._hierarchy != ag.structure_type_handler.data_hierarchy
+
+    def match(self, tier_name, pattern):
+        """Search a pattern in the values of a tier.
+
+        Parameters
+        ----------
+        tier_name : str
+            The tier to search in.
+        pattern : regular expression object
+            The compiled search pattern.
+
+        Returns
+        -------
+        bitmap : int
+            The bitmap of the root nodes with a match.
+        spans : dict
+            The start and end positions of the matches for each node ID.
+
+        """
+
+        key = (tier_name, pattern.pattern, pattern.flags)
+        if key in self._matches:
+            return self._matches[key]
+
+        candidates = None
+        search_index = self.annotation_graph.current_search_index()
+        if search_index is not None:
+            root_ids = search_index.candidates(tier_name, pattern)
+            if root_ids is not None:
+                candidates = set(self.ordinals[root_id]
+                                 for root_id in root_ids
+                                 if root_id in self.ordinals)
+
+        ordinals = []
+        spans = dict()
+        for ordinal, node_id, value in self.values[tier_name]:
+            if candidates is not None and ordinal not in candidates:
+                continue
+            node_spans = [ [m.start(), m.end()]
+                           for m in pattern.finditer(value) ]
+            if len(node_spans) > 0:
+                ordinals.append(ordinal)
+                spans[node_id] = node_spans
+
+        result = (bitmap_from_ordinals(ordinals, self.size), spans)
+        self._matches[key] = result
+        return result
+
+    def root_ids_for_bitmap(self, bitmap):
+        """Return the IDs of the root nodes in a bitmap, in the order of the
+        root nodes.
+
+        Parameters
+        ----------
+        bitmap : int
+
+        Returns
+        -------
+        root_ids : list of str
+
+        """
+
+        return [self.root_ids[i] for i in ordinals_from_bitmap(bitmap)]
+
+    def bitmap_for_root_ids(self, root_ids):
+        """Return the bitmap for a list of root node IDs.
+
+        Parameters
+        ----------
+        root_ids : iterable of str
+
+        Returns
+        -------
+        bitmap : int
+
+        """
+
+        return bitmap_from_ordinals(
+            (self.ordinals[root_id] for root_id in root_ids
+             if root_id in self.ordinals), self.size)
+
+
+class Query(object):
+    """Base class of all queries. Sub-classes implement `evaluate`.
+
+    """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def evaluate(self, table, matchobject=None):
+        """Evaluate the query.
+
+        Parameters
+        ----------
+        table : TierValueTable
+            The values of the annotation graph.
+        matchobject : dict, optional
+            A dict from tier names to dicts, where the match spans of the
+            matching nodes are stored.
+
+        Returns
+        -------
+        bitmap : int
+            The bitmap of the matching root nodes.
+
+        """
+
+        raise NotImplementedError("Method must be implemented")
+
+
+class TierMatch(Query):
+    """Matches the root nodes where a regular expression matches one of the
+    annotation values of a tier.
+
+    """
+
+    def __init__(self, tier_name, pattern, flags=0):
+        self.tier_name = tier_name
+        if hasattr(pattern, "finditer"):
+            self.pattern = pattern
+        else:
+            self.pattern = re.compile(pattern, flags)
+
+    def evaluate(self, table, matchobject=None):
+        bitmap, spans = table.match(self.tier_name, self.pattern)
+        if matchobject is not None:
+            if self.tier_name not in matchobject:
+                matchobject[self.tier_name] = dict()
+            matchobject[self.tier_name].update(spans)
+        return bitmap
+
+
+class TierPresent(Query):
+    """Matches the root nodes where the tier occurs in the data structure
+    hierarchy below the root node.
+
+    """
+
+    def __init__(self, tier_name):
+        self.tier_name = tier_name
+
+    def evaluate(self, table, matchobject=None):
+        return table.present.get(self.tier_name, 0)
+
+
+class And(Query):
+    """Matches the root nodes that match all sub-queries.
+
+    """
+
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, table, matchobject=None):
+        bitmap = table.all
+        for query in self.queries:
+            bitmap &= query.evaluate(table, matchobject)
+        return bitmap
+
+
+class Or(Query):
+    """Matches the root nodes that match at least one sub-query.
+
+    """
+
+    def __init__(self, *queries):
+        self.queries = queries
+
+    def evaluate(self, table, matchobject=None):
+        bitmap = 0
+        for query in self.queries:
+            bitmap |= query.evaluate(table, matchobject)
+        return bitmap
+
+
+class Not(Query):
+    """Matches the root nodes that do not match the sub-query.
+
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def evaluate(self, table, matchobject=None):
+        return table.all & ~self.query.evaluate(table, matchobject)
@@ -8,7 +8,10 @@
 # For license information, see LICENSE.TXT
 
 import os
+import shutil
+import tempfile
 
+import poioapi.annotationgraph
 import poioapi.io.elan
 import poioapi.io.graf
 
@@ -94,4 +97,182 @@ class TestElan:
 
     def test__annotation_for_region(self):
         annotation = self.elan._annotation_for_region("W-Spch", 780, 1340)
-        assert annotation.attrib["ANNOTATION_ID"] == "a8"
\ No newline at end of file
+        assert annotation.attrib["ANNOTATION_ID"] == "a8"
+
+    def test_get_tier_by_name(self):
+        tier = self.elan.get_tier_by_name("W-Spch")
+        assert tier.name == "W-Spch"
+        assert tier.linguistic_type == self.elan.get_root_tiers()[1].linguistic_type
+
+        assert self.elan.get_tier_by_name("not-a-tier") is None
+
+    def test_streaming(self):
+        elan = poioapi.io.elan.Parser(self.filename, streaming=True)
+
+        assert len(elan.tree.findall("TIER/ANNOTATION")) == 0
+        assert elan.time_order == self.elan.time_order
+        assert elan.annotations.ids == self.elan.annotations.ids
+        assert elan.annotations.starts == self.elan.annotations.starts
+        assert elan.annotations.ends == self.elan.annotations.ends
+
+        root_tier = elan.get_root_tiers()[1] # W-Spch
+        annotations = elan.get_annotations_for_tier(root_tier)
+        expected = self.elan.get_annotations_for_tier(root_tier)
+        assert [a.id for a in annotations] == [a.id for a in expected]
+
+        child_tier = elan.get_child_tiers_for_tier(root_tier)[0] # W-Words
+        assert len(elan.get_annotations_for_tier(
+            child_tier, annotations[0])) == 12
+
+        assert elan._annotation_for_region("W-Spch", 780, 1340) == "a8"
+
+    def test_tiers(self):
+        elan = poioapi.io.elan.Parser(self.filename, tiers=["W-Words"])
+
+        root_tiers = elan.get_root_tiers()
+        assert [t.name for t in root_tiers] == ["W-Spch"]
+        child_tiers = elan.get_child_tiers_for_tier(root_tiers[0])
+        assert [t.name for t in child_tiers] == ["W-Words"]
+        assert elan.get_tier_by_name("W-POS") is None
+        assert len(elan.meta_information.findall("TIER")) == 2
+
+        annotations = elan.get_annotations_for_tier(root_tiers[0])
+        assert len(annotations) == 15
+        assert len(elan.get_annotations_for_tier(
+            child_tiers[0], annotations[0])) == 12
+
+    def test_tiers_unknown(self):
+        try:
+            poioapi.io.elan.Parser(self.filename, tiers=["unknown"])
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    def test_annotation_table(self):
+        table = self.elan.annotations
+        assert len(table.ids) == len(table.tiers) == len(table.starts)
+
+        row = table.ids.index("a8")
+        assert table.tier_prefixes[table.tiers[row]] == "utterance..W-Spch"
+        assert table.region(row) == (780, 4090)
+
+        annotation = table.annotation(row)
+        assert annotation.id == "a8"
+        assert annotation.value == table.value(row)
+
+    def test_templates(self):
+        templates = {}
+        elan1 = poioapi.io.elan.Parser(self.filename, templates=templates)
+        elan2 = poioapi.io.elan.Parser(self.filename, streaming=True,
+            templates=templates)
+        assert len(templates) == 1
+        assert elan1.template is elan2.template
+
+        elan3 = poioapi.io.elan.Parser(self.filename, tiers=["W-Words"],
+            templates=templates)
+        assert len(templates) == 2
+        assert elan3.template is not elan1.template
+
+        converter = poioapi.io.graf.GrAFConverter(elan1)
+        converter.parse()
+        assert elan1.template.tier_hierarchies == converter.tier_hierarchies
+
+        converter = poioapi.io.graf.GrAFConverter(elan2)
+        converter.parse()
+        assert elan2.template.tier_hierarchies == converter.tier_hierarchies
+        assert elan2.template.tier_hierarchies is not \
+            converter.tier_hierarchies
+
+
+def test_region_index():
+    region_index = poioapi.io.elan.RegionIndex(
+        [(0, 100, "a"), (50, 200, "b"), (0, 300, "c"), (50, 200, "d")])
+
+    assert region_index.containing(10, 90) == "a"
+    assert region_index.containing(60, 150) == "b"
+    assert region_index.containing(20, 250) == "c"
+    assert region_index.containing(250, 350) is None
+
+
+def test_writer_round_trip():
+    filename = os.path.join(os.path.dirname(__file__), "..", "..", "..",
+        "..", "example_data", "turkish.eaf")
+    parser = poioapi.io.elan.Parser(filename)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        outputfile = os.path.join(tmpdir, "turkish.eaf")
+        ag = poioapi.annotationgraph.AnnotationGraph.from_elan(filename)
+        ag.to_elan(outputfile)
+        written = poioapi.io.elan.Parser(outputfile)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    def annotations(p):
+        table = p.annotations
+        return [table.annotation(row) for row in range(len(table.ids))]
+
+    assert [(a.id, a.value, a.features) for a in annotations(written)] == \
+        [(a.id, a.value, a.features) for a in annotations(parser)]
+    assert any("previous_node" in a.features for a in annotations(written))
+
+
+def test_unaligned_time_slots():
+    eaf = """<?xml version="1.0" encoding="UTF-8"?>
+<ANNOTATION_DOCUMENT AUTHOR="" DATE="2006-06-13T15:09:43+01:00" FORMAT="2.3" VERSION="2.3">
+    <HEADER MEDIA_FILE="" TIME_UNITS="milliseconds"/>
+    <TIME_ORDER>
+        <TIME_SLOT TIME_SLOT_ID="ts1" TIME_VALUE="0"/>
+        <TIME_SLOT TIME_SLOT_ID="ts2"/>
+        <TIME_SLOT TIME_SLOT_ID="ts3" TIME_VALUE="500"/>
+        <TIME_SLOT TIME_SLOT_ID="ts4"/>
+        <TIME_SLOT TIME_SLOT_ID="ts5"/>
+    </TIME_ORDER>
+    <TIER DEFAULT_LOCALE="en" LINGUISTIC_TYPE_REF="utterance" PARTICIPANT="" TIER_ID="W-Spch">
+        <ANNOTATION>
+            <ALIGNABLE_ANNOTATION ANNOTATION_ID="a1" TIME_SLOT_REF1="ts1" TIME_SLOT_REF2="ts2">
+                <ANNOTATION_VALUE>so</ANNOTATION_VALUE>
+            </ALIGNABLE_ANNOTATION>
+        </ANNOTATION>
+        <ANNOTATION>
+            <ALIGNABLE_ANNOTATION ANNOTATION_ID="a2" TIME_SLOT_REF1="ts2" TIME_SLOT_REF2="ts3">
+                <ANNOTATION_VALUE>from</ANNOTATION_VALUE>
+            </ALIGNABLE_ANNOTATION>
+        </ANNOTATION>
+        <ANNOTATION>
+            <ALIGNABLE_ANNOTATION ANNOTATION_ID="a3" TIME_SLOT_REF1="ts3" TIME_SLOT_REF2="ts4">
+                <ANNOTATION_VALUE>here</ANNOTATION_VALUE>
+            </ALIGNABLE_ANNOTATION>
+        </ANNOTATION>
+        <ANNOTATION>
+            <ALIGNABLE_ANNOTATION ANNOTATION_ID="a4" TIME_SLOT_REF1="ts4" TIME_SLOT_REF2="ts5">
+                <ANNOTATION_VALUE>on</ANNOTATION_VALUE>
+            </ALIGNABLE_ANNOTATION>
+        </ANNOTATION>
+    </TIER>
+    <LINGUISTIC_TYPE GRAPHIC_REFERENCES="false" LINGUISTIC_TYPE_ID="utterance" TIME_ALIGNABLE="true"/>
+</ANNOTATION_DOCUMENT>
+"""
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, "unaligned.eaf")
+        with open(filename, "wb") as f:
+            f.write(eaf.encode("utf-8"))
+
+        for streaming in [False, True]:
+            parser = poioapi.io.elan.Parser(filename, streaming=streaming)
+
+            # the last time slot without a value is set to -1, the others
+            # get the sum of the values of the time slots of their
+            # annotations that are known when they are resolved
+            assert parser.time_order == {"ts1": 0, "ts2": 500, "ts3": 500,
+                "ts4": 499, "ts5": -1}
+
+        parser = poioapi.io.elan.Parser(filename)
+        assert parser._time_slot_neighbours() == {"ts1": set(["ts2"]),
+            "ts2": set(["ts1", "ts3"]), "ts3": set(["ts2", "ts4"]),
+            "ts4": set(["ts3", "ts5"]), "ts5": set(["ts4"])}
+    finally:
+        shutil.rmtree(tmpdir)
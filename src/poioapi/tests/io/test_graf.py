@@ -8,6 +8,8 @@
 # For license information, see LICENSE.TXT
 
 import os
+import shutil
+import tempfile
 
 import poioapi.io.elan
 import poioapi.io.graf
@@ -115,6 +117,72 @@ class SimpleParser(poioapi.io.graf.BaseParser):
     def get_primary_data(self):
         pass
 
+
+class DeepParser(poioapi.io.graf.BaseParser):
+    """A chain of tiers with one annotation per parent annotation."""
+
+    def __init__(self, depth):
+        self.depth = depth
+
+    def get_root_tiers(self):
+        return [poioapi.io.graf.Tier("t0")]
+
+    def get_child_tiers_for_tier(self, tier):
+        level = int(tier.name[1:]) + 1
+        if level < self.depth:
+            return [poioapi.io.graf.Tier("t{0}".format(level))]
+
+        return None
+
+    def get_annotations_for_tier(self, tier, annotation_parent=None):
+        if annotation_parent is None:
+            return [poioapi.io.graf.Annotation(i, "root") for i in range(2)]
+
+        return [poioapi.io.graf.Annotation(annotation_parent.id + 2,
+            tier.name)]
+
+    def tier_has_regions(self, tier):
+        return False
+
+    def region_for_annotation(self, annotation):
+        pass
+
+    def get_primary_data(self):
+        pass
+
+
+class ChildlessRootParser(poioapi.io.graf.BaseParser):
+    """Two utterances, only the second one has a translation."""
+
+    def get_root_tiers(self):
+        return [poioapi.io.graf.Tier("utterance")]
+
+    def get_child_tiers_for_tier(self, tier):
+        if tier.name == "utterance":
+            return [poioapi.io.graf.Tier("translation")]
+
+        return None
+
+    def get_annotations_for_tier(self, tier, annotation_parent=None):
+        if tier.name == "utterance":
+            return [poioapi.io.graf.Annotation("a1", "first"),
+                    poioapi.io.graf.Annotation("a2", "second")]
+
+        if annotation_parent.id == "a2":
+            return [poioapi.io.graf.Annotation("a3", "translation")]
+
+        return []
+
+    def tier_has_regions(self, tier):
+        return False
+
+    def region_for_annotation(self, annotation):
+        pass
+
+    def get_primary_data(self):
+        pass
+
+
 class TestGrAFConverter:
     def setup(self):
         self.parser = SimpleParser()
@@ -166,6 +234,40 @@ class TestGrAFConverter:
         assert edge.from_node == self.graph.nodes['utterance..n0']
         assert edge.to_node == self.graph.nodes['word..n2']
 
+    def test_children_for_tier(self):
+        children = self.converter.children_for_tier['utterance..n0']
+
+        assert [n.id for n in children['word']] == \
+            ['word..n2', 'word..n3', 'word..n4', 'word..n5']
+        assert [n.id for n in self.converter.children_for_tier[
+            'word..n2']['wfw']] == ['wfw..n14']
+
+    def test_node_order_with_childless_root(self):
+        converter = poioapi.io.graf.GrAFConverter(ChildlessRootParser())
+        converter.parse()
+
+        assert [n.id for n in converter.graf.nodes] == \
+            ["utterance..na1", "utterance..na2", "translation..na3"]
+        assert [e.to_node.id for e in converter.graf.edges] == \
+            ["translation..na3"]
+
+    def test_tier_hierarchies(self):
+        assert self.converter.tier_hierarchies == \
+            [["utterance", ["word", ["graid"], ["wfw"]]]]
+
+    def test_deep_hierarchy(self):
+        converter = poioapi.io.graf.GrAFConverter(DeepParser(2000))
+        converter.parse()
+
+        assert len(converter.graf.nodes) == 4000
+        assert [n.id for n in converter.graf.nodes][:3] == \
+            ["t0..n0", "t1..n2", "t2..n4"]
+        assert converter.graf.header.roots == ["t0..n0", "t0..n1"]
+        assert [n.id for n in converter.children_for_tier["t1..n2"]["t2"]] \
+            == ["t2..n4"]
+        assert len(converter.graf.annotation_spaces) == 2000
+        assert converter.tier_hierarchies[0][1][1][0] == "t2"
+
     def test_get_annotations_spaces_from_graf(self):
         annotation_spaces = self.graph.annotation_spaces
 
@@ -189,3 +291,50 @@ class TestGrAFConverter:
             ['phonetic_transcription..W-IPA']]
 
         assert expected_tier_hierarchies in converter.tier_hierarchies
+
+    def test_partition_graph(self):
+        writer = poioapi.io.graf.Writer()
+        writer._partition_graph(self.graph,
+            ["utterance", "word", "wfw", "graid"])
+
+        assert len(writer._nodes["utterance"]) == 2
+        assert len(writer._nodes["word"]) == 8
+        assert all(n.id.startswith("word..") for n in writer._nodes["word"])
+        assert len(writer._edges["utterance"]) == 0
+        assert [e.to_node for e in writer._edges["word"]] == \
+            writer._nodes["word"]
+        assert writer._roots["utterance"] == self.graph.header.roots
+        assert "word" not in writer._roots
+
+    def test_render_tiers(self):
+        filename = os.path.join(os.path.dirname(__file__), "..", "sample_files",
+            "elan_graf", "example.eaf")
+
+        converter = poioapi.io.graf.GrAFConverter(
+            poioapi.io.elan.Parser(filename))
+        converter.parse()
+        tier_names = poioapi.io.graf.Writer()._flatten_hierarchy_elements(
+            converter.tier_hierarchies)
+
+        outputdir = tempfile.mkdtemp()
+        try:
+            outputs = []
+            for workers, processes in [(None, False), (2, False), (2, True)]:
+                writer = poioapi.io.graf.Writer(workers=workers,
+                    processes=processes)
+                writer._get_parents(converter.tier_hierarchies)
+                writer._partition_graph(converter.graf, tier_names)
+                jobs = [(tier_name, os.path.join(outputdir,
+                    "{0}-{1}.xml".format(workers, tier_name)))
+                    for tier_name in tier_names]
+                writer._render_tiers(converter.graf, jobs)
+
+                files = []
+                for _, outputfile in jobs:
+                    with open(outputfile, "rb") as f:
+                        files.append(f.read())
+                outputs.append(files)
+
+            assert outputs[0] == outputs[1] == outputs[2]
+        finally:
+            shutil.rmtree(outputdir)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Poio Tools for Linguists
+#
+# Copyright (C) 2009-2013 Poio Project
+# URL: <http://media.cidles.eu/poio/>
+# For license information, see LICENSE.TXT
+
+from __future__ import unicode_literals
+
+import io
+import xml.etree.ElementTree as ET
+from xml.dom import minidom
+
+import poioapi.io.xmlwriter
+
+
+def _example_tree():
+    root = ET.Element("ANNOTATION_DOCUMENT", {"AUTHOR": "a & b",
+        "{http://www.w3.org/2001/XMLSchema-instance}"
+        "noNamespaceSchemaLocation": "EAFv2.7.xsd"})
+    header = ET.SubElement(root, "HEADER", {"TIME_UNITS": "milliseconds"})
+    ET.SubElement(header, "PROPERTY", {"NAME": "x"}).text = "<Äußerung>"
+    ET.SubElement(root, "TIME_ORDER")
+    tier = ET.SubElement(root, "TIER", {"TIER_ID": "W-Spch"})
+    tier.text = "text"
+    annotation = ET.SubElement(tier, "ANNOTATION")
+    annotation.tail = "tail"
+    return root
+
+
+def test_write_pretty_xml():
+    root = _example_tree()
+
+    stream = io.BytesIO()
+    poioapi.io.xmlwriter.write_pretty_xml(stream, root, indent="    ",
+        encoding="UTF-8")
+    expected = minidom.parseString(ET.tostring(root)).toprettyxml(
+        indent="    ", encoding="UTF-8")
+    assert stream.getvalue() == expected
+
+    stream = io.StringIO()
+    poioapi.io.xmlwriter.write_pretty_xml(stream, root, indent="  ")
+    expected = minidom.parseString(ET.tostring(root)).toprettyxml(
+        indent="  ")
+    assert stream.getvalue() == expected
+
+
+def test_write_pretty_xml_chunks():
+    root = ET.Element("TIER")
+    for i in range(10000):
+        ET.SubElement(root, "ANNOTATION", {"ANNOTATION_ID": "a{0}".format(i)})
+
+    class Stream(object):
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, data):
+            self.chunks.append(data)
+
+    stream = Stream()
+    poioapi.io.xmlwriter.write_pretty_xml(stream, root, encoding="utf-8")
+    assert len(stream.chunks) > 1
+    assert b"".join(stream.chunks) == minidom.parseString(
+        ET.tostring(root)).toprettyxml(encoding="utf-8")
+
+
+def test_write_pretty_xml_namespaces():
+    root = ET.Element("{http://example.org/a}root",
+        {"{http://www.w3.org/XML/1998/namespace}lang": "de",
+         "{http://example.org/b}type": "x"})
+    ET.SubElement(root, "{http://example.org/a}child",
+        {"{http://www.w3.org/2001/XMLSchema-instance}type": "y"})
+    ET.SubElement(root, "{http://example.org/c}child")
+
+    stream = io.StringIO()
+    poioapi.io.xmlwriter.write_pretty_xml(stream, root)
+    expected = minidom.parseString(ET.tostring(root)).toprettyxml()
+    assert stream.getvalue() == expected
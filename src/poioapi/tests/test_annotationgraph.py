@@ -10,6 +10,12 @@
 from __future__ import unicode_literals
 
 import os
+import re
+import io
+import shutil
+import tempfile
+
+import graf
 
 from poioapi import data
 import poioapi.annotationgraph
@@ -37,12 +43,136 @@ class TestAnnotationGraph:
         root_nodes = self.annotation_graph.root_nodes()
         assert(len(root_nodes) == 9)
 
+    def test_root_nodes_window(self):
+        root_nodes = self.annotation_graph.root_nodes()
+        assert self.annotation_graph.root_nodes(2, 3) == root_nodes[2:5]
+        assert self.annotation_graph.root_nodes(7) == root_nodes[7:]
+
+    def test_root_node_ids(self):
+        root_ids = self.annotation_graph.root_node_ids()
+        ordinals = self.annotation_graph.root_ordinals()
+        assert root_ids == [n.id for n in self.annotation_graph.root_nodes()]
+        assert [ordinals[i] for i in root_ids] == list(range(9))
+
+        # the order is cached per data structure type
+        handler = self.annotation_graph.structure_type_handler
+        self.annotation_graph.structure_type_handler = \
+            data.DataStructureType(["Glosse..P-Gloss"])
+        assert len(self.annotation_graph.root_node_ids()) > 9
+        self.annotation_graph.structure_type_handler = handler
+        assert self.annotation_graph.root_node_ids() is root_ids
+
+        self.annotation_graph.graf.nodes.add(
+            graf.Node("Äußerung..P-Spch..na9999"))
+        self.annotation_graph.build_indexes()
+        assert len(self.annotation_graph.root_node_ids()) == 10
+
     def test_nodes_for_tier(self):
         root_nodes = self.annotation_graph.root_nodes()
         nodes = self.annotation_graph.nodes_for_tier("Äußerung", root_nodes[0])
         
         assert(len(nodes) == 0)
 
+    def test_nodes_for_tier_without_parent(self):
+        nodes = self.annotation_graph.nodes_for_tier("Glosse..P-Gloss")
+        expected = [n for n in self.annotation_graph.graf.nodes
+                    if n.id.startswith("Glosse..P-Gloss..")]
+        assert(len(nodes) > 0)
+        assert(nodes == expected)
+
+        nodes = self.annotation_graph.nodes_for_tier("Glosse")
+        assert(nodes == expected)
+
+        new_node = graf.Node("Glosse..P-Gloss..na9999")
+        self.annotation_graph.graf.nodes.add(new_node)
+        self.annotation_graph.build_indexes()
+        nodes = self.annotation_graph.nodes_for_tier("Glosse..P-Gloss")
+        assert(nodes[-1] == new_node)
+
+        # the graph is not watched for changes, the indexes are only
+        # rebuilt by build_indexes
+        old_node = nodes[0]
+        self.annotation_graph.graf.nodes.pop(old_node.id)
+        other_node = graf.Node("Glosse..P-Gloss..na99999")
+        self.annotation_graph.graf.nodes.add(other_node)
+        assert self.annotation_graph.nodes_for_tier("Glosse..P-Gloss") == \
+            nodes
+        self.annotation_graph.build_indexes()
+        nodes = self.annotation_graph.nodes_for_tier("Glosse..P-Gloss")
+        assert old_node not in nodes
+        assert nodes[-1] == other_node
+
+    def test_to_graf_workers(self):
+        outputdir = tempfile.mkdtemp()
+        try:
+            outputs = []
+            for workers in [None, 2]:
+                tier_dir = os.path.join(outputdir, str(workers))
+                os.mkdir(tier_dir)
+                self.annotation_graph.to_graf(
+                    os.path.join(tier_dir, "turkish.hdr"), workers=workers)
+
+                files = dict()
+                for name in os.listdir(tier_dir):
+                    if not name.endswith(".hdr"):
+                        with open(os.path.join(tier_dir, name), "rb") as f:
+                            files[name] = f.read()
+                outputs.append(files)
+
+            assert len(outputs[0]) > 0
+            assert outputs[0] == outputs[1]
+        finally:
+            shutil.rmtree(outputdir)
+
+    def test_nodes_in_range(self):
+        filename = os.path.join(os.path.dirname(__file__), 'sample_files',
+            'elan_graf', 'example.eaf')
+        ag = poioapi.annotationgraph.AnnotationGraph.from_elan(filename)
+
+        nodes = ag.nodes_in_range("words..W-Words", 1000, 1600)
+        assert [n.links[0][0].anchors for n in nodes] == \
+            [[780, 1340], [1340, 1570], [1570, 1810]]
+
+        nodes = ag.nodes_in_range("words..W-Words", 1000, 1600,
+            contained=True)
+        assert [n.links[0][0].anchors for n in nodes] == [[1340, 1570]]
+
+        nodes = ag.nodes_in_range("words..W-Words", 1340, 1340)
+        assert [n.links[0][0].anchors for n in nodes] == [[1340, 1570]]
+
+        utterance = ag.nodes_in_range("utterance..W-Spch", 780, 781)[0]
+        assert ag.overlapping(utterance) == []
+        words = ag.overlapping(utterance, "words..W-Words")
+        assert words == ag.nodes_for_tier("words..W-Words", utterance)
+
+    def test_from_elan_tiers(self):
+        filename = os.path.join(os.path.dirname(__file__), 'sample_files',
+            'elan_graf', 'example.eaf')
+        full = poioapi.annotationgraph.AnnotationGraph.from_elan(filename)
+        ag = poioapi.annotationgraph.AnnotationGraph.from_elan(filename,
+            tiers=["W-Words"])
+
+        assert ag.tier_hierarchies == \
+            [['utterance..W-Spch', ['words..W-Words']]]
+        for tier_name in ["utterance..W-Spch", "words..W-Words"]:
+            assert [n.id for n in ag.nodes_for_tier(tier_name)] == \
+                [n.id for n in full.nodes_for_tier(tier_name)]
+        assert ag.nodes_for_tier("part of speech..W-POS") == []
+
+    def test_from_elan_files(self):
+        filename = os.path.join(os.path.dirname(__file__), 'sample_files',
+            'elan_graf', 'example.eaf')
+        turkish = os.path.abspath(os.path.join(os.path.dirname( __file__ ),
+            '..', '..', '..', 'example_data', 'turkish.eaf'))
+
+        ags = list(poioapi.annotationgraph.AnnotationGraph.from_elan_files(
+            [filename, turkish, filename]))
+        assert len(ags) == 3
+        assert ags[1].tier_hierarchies == \
+            self.annotation_graph.tier_hierarchies
+        assert ags[0].tier_hierarchies == ags[2].tier_hierarchies
+        assert ags[0].root_node_ids() == ags[2].root_node_ids()
+
     def test_annotations_for_tier(self):
         node = self.annotation_graph.graf.nodes["Glosse..P-Gloss..na262"]
         annotations = self.annotation_graph.annotations_for_tier("Glosse", node)
@@ -64,6 +194,33 @@ class TestAnnotationGraph:
         html = self.annotation_graph.as_html_table()
         assert(len(html) > 0)
 
+    def test_write_html_table(self):
+        fragments = list(self.annotation_graph.iter_html_table())
+        assert len(fragments) == 9 + 2
+
+        stream = io.StringIO()
+        self.annotation_graph.write_html_table(stream)
+        assert stream.getvalue() == "".join(fragments)
+        assert stream.getvalue() == self.annotation_graph.as_html_table()
+
+    def test_as_html_table_window(self):
+        fragments = list(self.annotation_graph.iter_html_table(
+            full_html=False, start=2, count=3))
+        all_fragments = list(self.annotation_graph.iter_html_table(
+            full_html=False))
+        assert fragments == all_fragments[2:5]
+
+        self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "ANOM")
+        self.annotation_graph.append_filter(self.anngraphfilter)
+        html = self.annotation_graph.as_html_table(filtered=True,
+            full_html=False, start=1, count=1)
+        assert html == all_fragments[8]
+
+    def test_as_tree_window(self):
+        tree = self.annotation_graph.as_tree(start=2, count=3)
+        root_nodes = self.annotation_graph.root_nodes(2, 3)
+        assert [c.id for c in tree.children] == [n.id for n in root_nodes]
+
     def test_append_filter(self):
         self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "ANOM")
         self.annotation_graph.append_filter(self.anngraphfilter)
@@ -72,6 +229,16 @@ class TestAnnotationGraph:
         assert self.annotation_graph.filtered_node_ids[-1] == \
             ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']
 
+    def test_append_filter_with_flags(self):
+        self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "anom",
+            re.IGNORECASE)
+        self.annotation_graph.append_filter(self.anngraphfilter)
+
+        assert self.annotation_graph.filtered_node_ids[-1] == \
+            ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']
+        assert self.anngraphfilter.match_spans(
+            "Glosse..P-Gloss", "ANOM-anom") == [[0, 4], [5, 9]]
+
     def test_reset_filters(self):
         self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "ANOM")
         self.annotation_graph.append_filter(self.anngraphfilter)
@@ -80,6 +247,53 @@ class TestAnnotationGraph:
         assert self.annotation_graph.filtered_node_ids[-1] == \
             ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']
 
+    def test_append_filter_with_search_index(self):
+        search_index = self.annotation_graph.build_search_index()
+        self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "ANOM")
+
+        candidates = search_index.candidates("Glosse..P-Gloss",
+            self.anngraphfilter._pattern_for_tier("Glosse..P-Gloss"))
+        assert 'Äußerung..P-Spch..na2' in candidates
+        assert 'Äußerung..P-Spch..na1' not in candidates
+
+        self.annotation_graph.append_filter(self.anngraphfilter)
+
+        assert self.annotation_graph.filtered_node_ids[-1] == \
+            ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']
+
+        # the values of root nodes that are not candidates are not searched
+        search_index.candidates = \
+            lambda tier_name, pattern: set(['Äußerung..P-Spch..na9'])
+        self.annotation_graph.init_filters()
+        self.annotation_graph._tier_value_table = None
+        self.annotation_graph.append_filter(self.anngraphfilter)
+
+        assert self.annotation_graph.filtered_node_ids[-1] == \
+            ['Äußerung..P-Spch..na9']
+
+    def test_stacked_filters(self):
+        self.anngraphfilter.set_filter_for_tier("Glosse..P-Gloss", "ANOM")
+        self.annotation_graph.append_filter(self.anngraphfilter)
+
+        second_filter = poioapi.annotationgraph.AnnotationGraphFilter(
+            self.annotation_graph)
+        second_filter.set_filter_for_tier("Glosse..P-Gloss", "yesterday")
+        self.annotation_graph.append_filter(second_filter)
+
+        assert self.annotation_graph.filtered_node_ids[-1] == []
+        assert self.annotation_graph.as_html_table(
+            filtered=True, full_html=False) == ""
+
+        second_filter.set_filter_for_tier("Glosse..P-Gloss", "")
+        self.annotation_graph.reset_filters(1)
+
+        assert self.annotation_graph.filtered_node_ids == \
+            [['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9'],
+             ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']]
+
+        self.annotation_graph.pop_filter()
+        assert len(self.annotation_graph.filtered_node_ids) == 1
+
     def test_create_filter_for_dict(self):
         search_terms = { "Glosse..P-Gloss": "yesterday" }
         self.anngraphfilter = self.annotation_graph.create_filter_for_dict(
@@ -106,6 +320,19 @@ class TestAnnotationGraph:
             trimmed = set(original)
             assert len(original) == len(trimmed)
 
+    def test_required_literals(self):
+        required_literals = poioapi.annotationgraph._required_literals
+
+        assert required_literals(re.compile(r"\bÄußerung\b")) == \
+            [("Äußerung", True)]
+        assert required_literals(re.compile(r"colou?r[sz]\.")) == \
+            [("colo", False), ("r", False), (".", False)]
+        assert required_literals(re.compile(r"a(b|c)de")) == \
+            [("a", False), ("de", False)]
+        assert required_literals(re.compile(r"ANOM|yesterday")) == []
+        assert required_literals(re.compile(r"(?i)ANOM")) == []
+        assert required_literals(re.compile(r"ANOM", re.IGNORECASE)) == []
+
 class TestAnnotationGraphFilter:
 
     def setup(self):
@@ -141,3 +368,38 @@ class TestAnnotationGraphFilter:
 
         assert(self.anngraphfilter.element_passes_filter(element)
                == expected_result)
+
+
+class TestLazyAnnotationGraph:
+
+    def test_lazy_graf(self):
+        filename = os.path.join(os.path.dirname(__file__), "sample_files",
+            "balochi_graf", "balochi.hdr")
+        ag = poioapi.annotationgraph.AnnotationGraph.from_graf(filename,
+            lazy=True)
+        ag.structure_type_handler = data.DataStructureTypeGraid()
+
+        assert len(ag.graf.nodes) == 0
+
+        utterances = ag.nodes_for_tier("utterance")
+        assert len(utterances) == 111
+        assert ag.graf_loader.loaded == set(["utterance"])
+
+        # the word file depends on the clause units
+        clause_units = ag.nodes_for_tier("clause_unit", utterances[0])
+        words = ag.nodes_for_tier("word", clause_units[0])
+        assert len(words) == 6
+        assert ag.graf_loader.loaded == \
+            set(["utterance", "clause_unit", "word"])
+
+        anngraphfilter = poioapi.annotationgraph.AnnotationGraphFilter(ag)
+        anngraphfilter.set_filter_for_tier("graid2", "nc")
+        assert anngraphfilter.element_passes_filter(
+            ag.graf.nodes['utterance..na6'])
+
+        # the tiers of the hierarchy are loaded before the caches are built
+        table = ag.tier_value_table()
+        root_ids = ag.root_node_ids()
+        assert not table.is_stale()
+        assert ag.tier_value_table() is table
+        assert ag.root_node_ids() is root_ids
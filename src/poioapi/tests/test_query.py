@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Poio Tools for Linguists
+#
+# Copyright (C) 2009-2013 Poio Project
+# Author: Peter Bouda <pbouda@cidles.eu>
+# URL: <http://media.cidles.eu/poio/>
+# For license information, see LICENSE.TXT
+
+from __future__ import unicode_literals
+
+import os
+
+import poioapi.annotationgraph
+import poioapi.query
+
+
+def test_bitmap_from_ordinals():
+    bitmap = poioapi.query.bitmap_from_ordinals([0, 3, 9], 12)
+    assert bitmap == 0b1000001001
+    assert poioapi.query.ordinals_from_bitmap(bitmap) == [0, 3, 9]
+    assert poioapi.query.ordinals_from_bitmap(0) == []
+
+
+class TestQuery:
+
+    def setup(self):
+        filename = os.path.abspath(os.path.join(os.path.dirname( __file__ ),
+            '..', '..', '..', 'example_data', 'turkish.eaf'))
+
+        self.annotation_graph = \
+            poioapi.annotationgraph.AnnotationGraph.from_elan(filename)
+
+    def test_tier_match(self):
+        query = poioapi.query.TierMatch("Glosse..P-Gloss", "ANOM")
+        assert self.annotation_graph.query(query) == \
+            ['Äußerung..P-Spch..na2', 'Äußerung..P-Spch..na9']
+
+    def test_boolean_operations(self):
+        anom = poioapi.query.TierMatch("Glosse..P-Gloss", "ANOM")
+        yesterday = poioapi.query.TierMatch("Glosse..P-Gloss", "yesterday")
+
+        assert self.annotation_graph.query(anom | yesterday) == \
+            ['Äußerung..P-Spch..na1', 'Äußerung..P-Spch..na2',
+             'Äußerung..P-Spch..na9']
+        assert self.annotation_graph.query(anom & yesterday) == []
+
+        not_anom = self.annotation_graph.query(~anom)
+        assert len(not_anom) == 7
+        assert 'Äußerung..P-Spch..na2' not in not_anom
+
+    def test_match_spans(self):
+        matchobject = {}
+        query = poioapi.query.TierMatch("Glosse..P-Gloss", "ANOM")
+        query.evaluate(self.annotation_graph.tier_value_table(), matchobject)
+
+        assert len(matchobject["Glosse..P-Gloss"]) > 0
+        for spans in matchobject["Glosse..P-Gloss"].values():
+            assert spans == [[0, 4]]